@@ -0,0 +1,116 @@
+import zlib
+import numpy as np
+import pandas as pd
+
+# vocabulary of the synthetic comments, close to what shows up under product review videos
+ENGLISH_WORDS = ('the phone camera battery screen price quality video review great good bad love hate amazing awesome '
+                 'terrible worst best really very so too much not worth buy bought upgrade update design sound fast slow '
+                 'it is was this that i you my your and but for with on in of to just still after months years day').split()
+OTHER_WORDS = {
+    'es': 'el la los teléfono cámara batería muy bueno malo precio calidad me encanta pero no vale la pena'.split(),
+    'pt': 'o a os celular câmera bateria muito bom ruim preço qualidade eu amei mas não vale a pena'.split(),
+    'fr': 'le la les téléphone caméra batterie très bon mauvais prix qualité j\'adore mais ça ne vaut pas'.split(),
+}
+# spanish and portuguese comments made of words that are english stopwords too ("a", "no", "me", "o", "e"),
+# which the english language pre-filter must not take for english
+LOOKALIKE_COMMENTS = [
+    'no me gusta nada, a mi no me sirve',
+    'la verdad no lo recomiendo a nadie',
+    'a camera e top demais',
+    'eu amei o produto mas a bateria e ruim',
+]
+# templated spam: the same giveaway comment with a single word changed in each copy, which near-duplicate
+# collapsing must merge
+GIVEAWAY_SPAM = ('win a free iphone today just click the link in my profile and claim your prize before the '
+                 'offer ends tonight').split()
+EXTRAS = ['😀', '🔥', '👍', '😡', '😂', ':)', ':(', ':D', '<br>', '&quot;', '<a href="https://example.com/x">link</a>', '@someone']
+SHORT_COMMENTS = ['first!', 'lol', 'nice video', 'wow', '😂😂😂', '+1', 'who is here in 2024?', 'great']
+SPAM_COMMENTS = [
+    'Check out my channel for free giveaways!!! {}',
+    'I made $5000 this week working from home, visit {}',
+    'Subscribe to me and I will subscribe back {}',
+]
+
+# share of each kind of comment in the corpus
+ENGLISH_SHARE = 0.75
+OTHER_LANGUAGE_SHARE = 0.10
+SHORT_SHARE = 0.10 # the rest is spam
+
+# join rows of word indexes (up to each row's length) into sentences
+def join_words(words, indexes, lengths):
+    words = np.asarray(words, dtype=object)
+    return [' '.join(row[:length]) for row, length in zip(words[indexes], lengths)]
+
+# n comments in a given language of OTHER_WORDS
+def make_other_language_texts(language, n, rng):
+    words = OTHER_WORDS[language]
+    return join_words(words, rng.integers(0, len(words), size=(n, 20)), rng.integers(4, 20, size=n))
+
+# generate n comment texts: english sentences (some with emojis, emoticons, html and mentions), comments in
+# other languages, short content-free ones and near-duplicate spam, in a reproducible order for a given seed
+def make_texts(n, seed=42):
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(4, size=n, p=[ENGLISH_SHARE, OTHER_LANGUAGE_SHARE, SHORT_SHARE,
+                                     1 - ENGLISH_SHARE - OTHER_LANGUAGE_SHARE - SHORT_SHARE])
+    texts = np.empty(n, dtype=object)
+
+    english = np.flatnonzero(kinds == 0)
+    lengths = rng.integers(4, 30, size=len(english))
+    sentences = join_words(ENGLISH_WORDS, rng.integers(0, len(ENGLISH_WORDS), size=(len(english), 30)), lengths)
+    extras = rng.integers(0, 2 * len(EXTRAS), size=len(english)) # half of them get no extra
+    texts[english] = [sentence if extra >= len(EXTRAS) else f'{sentence} {EXTRAS[extra]}'
+                      for sentence, extra in zip(sentences, extras)]
+
+    other = np.flatnonzero(kinds == 1)
+    languages = rng.choice(list(OTHER_WORDS), size=len(other))
+    for language in OTHER_WORDS:
+        rows = other[languages == language]
+        texts[rows] = make_other_language_texts(language, len(rows), rng)
+
+    short = np.flatnonzero(kinds == 2)
+    texts[short] = np.asarray(SHORT_COMMENTS, dtype=object)[rng.integers(0, len(SHORT_COMMENTS), size=len(short))]
+
+    spam = np.flatnonzero(kinds == 3)
+    templates = rng.integers(0, len(SPAM_COMMENTS), size=len(spam))
+    suffixes = rng.integers(0, 50, size=len(spam)) # a few variants of each, so they collapse as near-duplicates
+    texts[spam] = [SPAM_COMMENTS[template].format(f'www.spam{suffix}.com') for template, suffix in zip(templates, suffixes)]
+
+    return texts.tolist()
+
+# n copies of GIVEAWAY_SPAM, each with a different word of it replaced by a different made-up word
+def make_variant_spam(n, seed=42):
+    rng = np.random.default_rng(seed)
+    texts = []
+    for i, position in enumerate(rng.integers(0, len(GIVEAWAY_SPAM), size=n)):
+        words = list(GIVEAWAY_SPAM)
+        words[position] = f'bonus{i}'
+        texts.append(' '.join(words))
+    return texts
+
+# seed of a page of comments, stable across processes (hash() of a str is not)
+def page_seed(video_id, offset):
+    return zlib.crc32(f'{video_id}:{offset}'.encode('utf-8'))
+
+# synthetic comments frame with the columns of parse_comment, spread evenly over n_videos videos
+def make_corpus(n_comments, n_videos=None, seed=42):
+    if n_videos is None:
+        n_videos = min(50, max(1, n_comments // 1000))
+    rng = np.random.default_rng(seed)
+    video_ids = np.arange(n_comments) % n_videos
+    published = np.datetime64('2024-01-01T00:00:00') + rng.integers(0, 365 * 24 * 3600, size=n_comments).astype('timedelta64[s]')
+    published = np.char.add(np.datetime_as_string(published, unit='s'), 'Z') # RFC 3339, as returned by the API
+
+    return pd.DataFrame({
+        'comment_id': [f'comment{i}' for i in range(n_comments)],
+        'video_id': [f'video{i:03d}' for i in video_ids],
+        'channel_id': 'channel',
+        'author_name': [f'author{i}' for i in rng.integers(0, max(1, n_comments // 3), size=n_comments)],
+        'author_channel_id': 'author_channel',
+        'like_count': rng.zipf(2.0, size=n_comments) - 1,
+        'total_reply_count': rng.integers(0, 3, size=n_comments),
+        'published': published,
+        'updated': published,
+        'text_display': make_texts(n_comments, seed),
+        'is_op': 0,
+        'parent_id': None,
+    })
@@ -0,0 +1,208 @@
+import json
+import multiprocessing
+import re
+import socket
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from corpus import make_texts, page_seed
+
+# local stand-ins for the Youtube Data API (search, videos, commentThreads, comments) and the OpenAI chat completions
+# endpoint, answering with the same shapes as the real services. Comment pages are generated on the fly
+# and are the same for the same video and page token, so every run sees the same corpus; every video has
+# as many pages as it's asked for, the pipeline's comment budget decides where to stop.
+# The server runs in a process of its own, so it doesn't share the GIL nor the memory measurements
+# with the code being benchmarked.
+
+VIDEO_POOL = 100 # videos the searches pick from, so different queries share some of their results
+INLINE_REPLIES = 5 # replies returned along with their thread by commentThreads(part="snippet,replies")
+
+# a comment (top-level or reply) of the list responses
+def comment_snippet(comment_id, text, like_count):
+    return {
+        'authorDisplayName': f'author {comment_id}',
+        'authorChannelId': {'value': f'author-{comment_id}'},
+        'likeCount': like_count,
+        'publishedAt': '2024-01-01T00:00:00Z',
+        'updatedAt': '2024-01-01T00:00:00Z',
+        'textDisplay': text,
+        'textOriginal': text,
+    }
+
+# number of replies of a thread, stable for its id: one thread in ten is much more discussed than the rest
+def reply_count(thread_id):
+    seed = zlib.crc32(thread_id.encode('utf-8'))
+    return 20 + seed % 200 if seed % 10 == 0 else seed % 3
+
+# replies [offset, offset + page_size) of a thread, the same whether they come inline or from comments().list
+def make_replies(thread_id, offset, page_size):
+    replies = []
+    for i in range(offset, offset + page_size):
+        reply_id = f'{thread_id}.{i}'
+        text = make_texts(1, page_seed(reply_id, 0))[0]
+        replies.append({
+            'kind': 'youtube#comment',
+            'id': reply_id,
+            'snippet': dict(comment_snippet(reply_id, text, i % 7), parentId=thread_id),
+        })
+    return replies
+
+# a thread of the commentThreads list response
+def comment_thread(video_id, comment_id, text, like_count, replies=False):
+    snippet = comment_snippet(comment_id, text, like_count)
+    thread = {
+        'kind': 'youtube#commentThread',
+        'id': comment_id,
+        'snippet': {
+            'channelId': 'channel',
+            'videoId': video_id,
+            'topLevelComment': {'kind': 'youtube#comment', 'id': comment_id, 'snippet': snippet},
+            'canReply': True,
+            'totalReplyCount': reply_count(comment_id),
+            'isPublic': True,
+        },
+    }
+    if replies and reply_count(comment_id) > 0:
+        thread['replies'] = {'comments': make_replies(comment_id, 0, min(INLINE_REPLIES, reply_count(comment_id)))}
+    return thread
+
+def search_response(query):
+    max_results = int(query.get('maxResults', ['5'])[0])
+    first = zlib.crc32(query.get('q', [''])[0].encode('utf-8'))
+    return {
+        'kind': 'youtube#searchListResponse',
+        'pageInfo': {'totalResults': max_results, 'resultsPerPage': max_results},
+        'items': [{
+            'kind': 'youtube#searchResult',
+            'id': {'kind': 'youtube#video', 'videoId': f'video-{(first + 7 * i) % VIDEO_POOL:03d}'},
+            'snippet': {'title': f'Review of product {i}', 'description': 'Synthetic video used by the benchmarks'},
+        } for i in range(max_results)],
+    }
+
+def videos_response(query):
+    return {
+        'kind': 'youtube#videoListResponse',
+        'items': [{
+            'kind': 'youtube#video',
+            'id': video_id,
+            'snippet': {'title': f'Video {video_id}', 'description': 'Synthetic video used by the benchmarks'},
+        } for video_id in query.get('id', [''])[0].split(',')],
+    }
+
+def comment_threads_response(query):
+    video_id = query['videoId'][0]
+    offset = int(query.get('pageToken', ['0'])[0])
+    page_size = int(query.get('maxResults', ['20'])[0])
+    seed = page_seed(video_id, offset)
+    texts = make_texts(page_size, seed)
+    replies = 'replies' in query.get('part', [''])[0].split(',')
+    return {
+        'kind': 'youtube#commentThreadListResponse',
+        'nextPageToken': str(offset + page_size),
+        'pageInfo': {'totalResults': page_size, 'resultsPerPage': page_size},
+        'items': [comment_thread(video_id, f'{video_id}-{offset + i}', text, (seed >> (i % 24)) % 50, replies)
+                  for i, text in enumerate(texts)],
+    }
+
+# replies of a thread, page by page
+def comments_response(query):
+    thread_id = query['parentId'][0]
+    offset = int(query.get('pageToken', ['0'])[0])
+    total = reply_count(thread_id)
+    page_size = max(0, min(int(query.get('maxResults', ['20'])[0]), total - offset))
+    response = {
+        'kind': 'youtube#commentListResponse',
+        'pageInfo': {'totalResults': page_size, 'resultsPerPage': page_size},
+        'items': make_replies(thread_id, offset, page_size),
+    }
+    if offset + page_size < total:
+        response['nextPageToken'] = str(offset + page_size)
+    return response
+
+# answer of the LLM for each of the prompts sent by the pipeline
+def chat_answer(system_prompt, user_prompt):
+    if 'RELEVANT' in system_prompt:
+        ids = re.findall(r'^\[(\d+)\]$', user_prompt, flags=re.MULTILINE)
+        return '\n'.join(f'[{i}]: RELEVANT' for i in ids) if ids else 'RELEVANT'
+    if 'OVERALL SENTIMENT' in system_prompt:
+        return 'OVERALL SENTIMENT: POSITIVE\nPOSITIVE: people like the product.\nNEGATIVE: some find it too expensive.'
+    return 'POSITIVE: most comments praise the product, a few complain about the price.'
+
+def chat_response(body):
+    messages = body['messages']
+    answer = chat_answer(messages[0]['content'], messages[-1]['content'])
+    prompt_tokens = sum(len(message['content']) for message in messages) // 4
+    completion_tokens = len(answer) // 4
+    return {
+        'id': 'chatcmpl-benchmark',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-3.5-turbo'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+class StandInHandler(BaseHTTPRequestHandler):
+    latency = 0.0 # seconds added to every answer, to mimic the real services
+
+    def send_json(self, data):
+        time.sleep(self.latency)
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith('/search'):
+            self.send_json(search_response(query))
+        elif url.path.endswith('/videos'):
+            self.send_json(videos_response(query))
+        elif url.path.endswith('/commentThreads'):
+            self.send_json(comment_threads_response(query))
+        elif url.path.endswith('/comments'):
+            self.send_json(comments_response(query))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.send_json(chat_response(body))
+
+    def log_message(self, format, *args):
+        pass
+
+# a free local port for the server
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def serve(port, latency=0.0):
+    StandInHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+# start the stand-in server in a background process, returning once it accepts connections
+def start_server(port, latency=0.0, timeout=10.0):
+    process = multiprocessing.Process(target=serve, args=(port, latency), daemon=True)
+    process.start()
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            if time.time() > deadline:
+                process.terminate()
+                raise
+            time.sleep(0.05)
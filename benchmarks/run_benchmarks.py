@@ -0,0 +1,370 @@
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import pandas as pd
+import psutil
+import pyarrow as pa
+import numpy as np
+from corpus import make_corpus, make_other_language_texts, make_variant_spam, OTHER_WORDS, LOOKALIKE_COMMENTS, ENGLISH_WORDS
+from fake_apis import free_port, start_server
+
+# offline benchmarks of the pipeline's hot paths, over synthetic corpora of 1k to 1M comments. The Youtube
+# and OpenAI calls are answered by local stand-ins (fake_apis.py), so only this code is being measured.
+# Results are saved as json, named after the current commit, and can be compared with an earlier run:
+#   python benchmarks/run_benchmarks.py --sizes 1000 10000 --compare benchmarks/results/<commit>.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# point the pipeline to the stand-ins before it reads its settings
+PORT = free_port()
+os.environ['YOUTUBE_API_ROOT'] = f'http://127.0.0.1:{PORT}/'
+os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{PORT}/v1'
+
+import sentiment_pipeline
+from sentiment_pipeline import SentimentPipeline, WordFrequencies, WORDCLOUD_TOP_WORDS, render_wordcloud
+from comment_store import compact_comments, load_comments, save_comments
+
+# corpus sizes of the local benchmarks, and of the ones going through the stand-in APIs
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+API_SIZES = [1_000, 10_000, 100_000]
+MAX_VIDEOS = 50 # search results of a single query
+
+# synthetic corpus of a given size, with the intermediate results shared by the benchmarks built on demand
+class Corpus:
+    def __init__(self, n_comments):
+        self.n_comments = n_comments
+        self.n_videos = min(MAX_VIDEOS, max(1, n_comments // 1000))
+        self.comments_per_video = math.ceil(n_comments / self.n_videos)
+        self.frame = None
+        self.preprocessed = None
+        self.frequencies = None
+
+    def comments(self):
+        if self.frame is None:
+            self.frame = compact_comments(make_corpus(self.n_comments, self.n_videos))
+        return self.frame
+
+    def preprocessed_comments(self):
+        if self.preprocessed is None:
+            self.frequencies = WordFrequencies()
+            self.preprocessed = sentiment_pipeline.preprocess_comments(self.comments(), frequencies=self.frequencies)
+        return self.preprocessed
+
+    # search results as returned by search_videos + classify_video
+    def videos(self):
+        return pd.DataFrame({
+            'video_id': [f'benchmark-{i:03d}' for i in range(self.n_videos)],
+            'video_title': [f'Review of product {i}' for i in range(self.n_videos)],
+            'video_description': 'Synthetic video used by the benchmarks',
+            'relevance': 'RELEVANT',
+        })
+
+# every benchmark prepares its input (not timed) and returns the function to be timed
+def bench_filter_english(corpus):
+    comments = corpus.comments()
+    return lambda: sentiment_pipeline.filter_english(comments)
+
+def bench_preprocessing(corpus):
+    texts = corpus.comments()['text_display']
+    engine = sentiment_pipeline.get_preprocessing_engine()
+    return lambda: engine.transform_batch(texts)
+
+def bench_preprocessing_all_cores(corpus):
+    comments = corpus.comments()
+    return lambda: sentiment_pipeline.preprocess_comments(comments, use_all_cores=True, frequencies=WordFrequencies())
+
+def bench_collapse_duplicates(corpus):
+    df = corpus.preprocessed_comments()
+    return lambda: sentiment_pipeline.collapse_duplicates(df)
+
+def bench_score_sentiment(corpus):
+    df = corpus.preprocessed_comments()
+    return lambda: sentiment_pipeline.score_sentiment(df)
+
+# pre-processed comments written to Parquet and memory-mapped back
+def bench_save_load_comments(corpus):
+    df = corpus.preprocessed_comments()
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            save_comments(df, os.path.join(directory, 'comments.parquet'))
+            return load_comments(os.path.join(directory, 'comments.parquet'))
+    return run
+
+# rendering of the wordcloud image, as done by plot_wordcloud for a table it hasn't drawn yet
+def bench_plot_wordcloud(corpus):
+    corpus.preprocessed_comments()
+    frequencies = corpus.frequencies
+    def run():
+        with tempfile.TemporaryDirectory() as cache_dir:
+            return render_wordcloud(frequencies.top(WORDCLOUD_TOP_WORDS), cache_dir)
+    return run
+
+# comment harvesting and assembly of the comments frame, from the stand-in commentThreads endpoint
+def bench_get_video_comments(corpus):
+    youtube = sentiment_pipeline.load_api('benchmark')
+    df_videos = corpus.videos()
+    return lambda: sentiment_pipeline.get_video_comments(df_videos, youtube, corpus.comments_per_video)
+
+# same, expanding the replies of the most discussed threads from the stand-in comments endpoint
+def bench_get_video_comments_with_replies(corpus):
+    youtube = sentiment_pipeline.load_api('benchmark')
+    df_videos = corpus.videos()
+    return lambda: sentiment_pipeline.get_video_comments(df_videos, youtube, corpus.comments_per_video,
+                                                         max_replies=sentiment_pipeline.MAX_REPLIES_PER_VIDEO)
+
+# a whole query, from the search to the final summary
+def bench_pipeline(corpus):
+    pipeline = SentimentPipeline('benchmark', 'benchmark', max_comments=corpus.comments_per_video)
+    return lambda: pipeline.run('benchmark query', corpus.n_videos)
+
+# three queries compared at once, their search results overlapping in the stand-in's pool of videos
+def bench_compare(corpus):
+    pipeline = SentimentPipeline('benchmark', 'benchmark', max_comments=corpus.comments_per_video)
+    return lambda: pipeline.compare(['benchmark query', 'competitor query', 'another competitor query'], corpus.n_videos)
+
+# name: (function, whether it goes through the stand-in APIs)
+BENCHMARKS = {
+    'filter_english': (bench_filter_english, False),
+    'preprocessing': (bench_preprocessing, False),
+    'preprocessing_all_cores': (bench_preprocessing_all_cores, False),
+    'collapse_duplicates': (bench_collapse_duplicates, False),
+    'score_sentiment': (bench_score_sentiment, False),
+    'save_load_comments': (bench_save_load_comments, False),
+    'plot_wordcloud': (bench_plot_wordcloud, False),
+    'get_video_comments': (bench_get_video_comments, True),
+    'get_video_comments_with_replies': (bench_get_video_comments_with_replies, True),
+    'pipeline': (bench_pipeline, True),
+    'compare': (bench_compare, True),
+}
+
+# correctness checks of the steps being sped up, over small fixtures: each returns the list of its failures
+# and they run before the benchmarks, so a faster step that got the results wrong never goes unnoticed
+
+# comments in other languages (including ones full of words that are english stopwords too) never pass as english
+def check_filter_english():
+    rng = np.random.default_rng(42)
+    texts = list(LOOKALIKE_COMMENTS)
+    for language in OTHER_WORDS:
+        texts.extend(make_other_language_texts(language, 300, rng))
+    english = sentiment_pipeline.filter_english(pd.DataFrame({'text_display': texts}))
+    return [f'taken for english: {text!r}' for text in english['text_display']]
+
+# copies of a templated spam comment collapse into (almost) a single one, while distinct comments are all kept
+def check_collapse_duplicates(max_spam_kept=5):
+    rng = np.random.default_rng(42)
+    engine = sentiment_pipeline.get_preprocessing_engine()
+    def collapse(texts):
+        df = pd.DataFrame({'text_display': texts, 'video_id': 'video', 'like_count': 0})
+        df['text_filtered'] = engine.transform_batch(df['text_display'])
+        return len(sentiment_pipeline.collapse_duplicates(df))
+
+    failures = []
+    spam_kept = collapse(make_variant_spam(50))
+    if spam_kept > max_spam_kept:
+        failures.append(f'50 spam variants collapsed into {spam_kept} comments (expected at most {max_spam_kept})')
+    distinct = [' '.join(rng.choice(ENGLISH_WORDS, size=rng.integers(8, 25))) for _ in range(500)]
+    distinct_kept = collapse(distinct)
+    if distinct_kept != len(distinct):
+        failures.append(f'{len(distinct)} distinct comments collapsed into {distinct_kept}')
+    return failures
+
+# name: check, run when its benchmark is selected
+CHECKS = {
+    'filter_english': check_filter_english,
+    'collapse_duplicates': check_collapse_duplicates,
+}
+
+def run_checks(names):
+    failures = []
+    for name in names:
+        if name in CHECKS:
+            failures.extend(f'{name}: {failure}' for failure in CHECKS[name]())
+    return failures
+
+# peak memory of the Arrow pool and RSS of the process (plus its worker processes) during a block, above their
+# level when it started: Arrow buffers, memory-mapped files and workers never show up in tracemalloc. Both are
+# sampled from a thread; pyarrow can't reset the peak of its pool, so the pool's own max_memory() is only used
+# when the block set a new record
+class MemorySampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.stopped = threading.Event()
+        self.arrow_peak = 0
+        self.rss_peak = 0
+
+    def rss(self):
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error: # the worker exited meanwhile
+                pass
+        return rss
+
+    def sample(self):
+        pool = pa.default_memory_pool()
+        self.arrow_peak = max(self.arrow_peak, pool.bytes_allocated() - self.arrow_start)
+        self.rss_peak = max(self.rss_peak, self.rss() - self.rss_start)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        pool = pa.default_memory_pool()
+        self.arrow_start, self.arrow_record = pool.bytes_allocated(), pool.max_memory()
+        self.rss_start = self.rss()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+        record = pa.default_memory_pool().max_memory()
+        if record > self.arrow_record:
+            self.arrow_peak = max(self.arrow_peak, record - self.arrow_start)
+
+# best wall time of "repeat" runs, then the peak memory during one more run: allocated by python (tracemalloc
+# slows the code down, so it's never on while timing), by Arrow and the RSS (see MemorySampler).
+# Returns (seconds, peaks in bytes or None, last result)
+def measure(run, repeat=1, memory=True):
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = run()
+        seconds.append(time.perf_counter() - start)
+
+    peaks = None
+    if memory:
+        result = None
+        gc.collect()
+        tracemalloc.start()
+        try:
+            with MemorySampler() as sampler:
+                result = run()
+            peaks = {'python': tracemalloc.get_traced_memory()[1], 'arrow': sampler.arrow_peak, 'rss': sampler.rss_peak}
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peaks, result
+
+# commit the benchmarks ran on, flagged when the tree had uncommitted changes
+def current_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True,
+                               text=True, check=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_benchmarks(names, sizes, api_sizes, repeat=1, memory=True, on_result=None):
+    results = []
+    for n_comments in sorted(set(sizes) | set(api_sizes)):
+        corpus = Corpus(n_comments)
+        for name in names:
+            bench, uses_api = BENCHMARKS[name]
+            if n_comments not in (api_sizes if uses_api else sizes):
+                continue
+
+            seconds, peaks, result = measure(bench(corpus), repeat, memory)
+            row = {
+                'benchmark': name,
+                'comments': n_comments,
+                'seconds': seconds,
+                'comments_per_second': n_comments / seconds if seconds > 0 else None,
+                'peak_mb': None if peaks is None else peaks['python'] / 2 ** 20,
+                'arrow_peak_mb': None if peaks is None else peaks['arrow'] / 2 ** 20,
+                'rss_peak_mb': None if peaks is None else peaks['rss'] / 2 ** 20,
+            }
+            if isinstance(result, dict) and result.get('metrics') is not None: # the pipeline times its own stages
+                row['stages'] = {stage: counters.get('wall_seconds') for stage, counters in result['metrics'].to_dict()['stages'].items()}
+            results.append(row)
+            if on_result is not None:
+                on_result(row)
+    return results
+
+# one line per benchmark and size, with the speedup and memory ratios against a baseline run when given
+# (runs saved before the Arrow and RSS peaks were measured have no ratio for them)
+def compare(results, baseline=None):
+    peaks = ['peak_mb', 'arrow_peak_mb', 'rss_peak_mb']
+    df = pd.DataFrame(results, columns=['benchmark', 'comments', 'seconds', 'comments_per_second', *peaks])
+    if baseline is not None:
+        df_baseline = pd.DataFrame(baseline['results'], columns=['benchmark', 'comments', 'seconds', *peaks])
+        df = df.merge(df_baseline, on=['benchmark', 'comments'], how='left', suffixes=('', '_baseline'))
+        df['speedup'] = df['seconds_baseline'] / df['seconds']
+        df['memory_ratio'] = df['peak_mb'] / df['peak_mb_baseline']
+        df['arrow_memory_ratio'] = df['arrow_peak_mb'] / df['arrow_peak_mb_baseline']
+        df['rss_ratio'] = df['rss_peak_mb'] / df['rss_peak_mb_baseline']
+        df = df.drop(columns=['seconds_baseline'] + [f'{peak}_baseline' for peak in peaks])
+    return df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the sentiment pipeline over synthetic comments.")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help="corpus sizes of the local benchmarks")
+    parser.add_argument('--api-sizes', nargs='+', type=int, default=API_SIZES,
+                        help="corpus sizes of the benchmarks going through the stand-in APIs")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per benchmark, the best time is kept")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the extra run measuring peak memory (python, Arrow and RSS with the worker processes)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every stand-in API answer")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="results file of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    failures = run_checks(args.benchmarks)
+    if len(failures) != 0:
+        print('\n'.join(failures), file=sys.stderr)
+        return 1
+
+    server = start_server(PORT, args.latency)
+    try:
+        def show(row):
+            peak = '-' if row['peak_mb'] is None else (f"{row['peak_mb']:.1f} MB (arrow {row['arrow_peak_mb']:.1f} MB, "
+                                                       f"rss {row['rss_peak_mb']:.1f} MB)")
+            print(f"{row['benchmark']:>24} {row['comments']:>9} comments: {row['seconds']:9.3f} s "
+                  f"{row['comments_per_second']:12.0f} comments/s  peak {peak}", file=sys.stderr)
+        results = run_benchmarks(args.benchmarks, args.sizes, args.api_sizes, args.repeat, not args.no_memory, show)
+    finally:
+        server.terminate()
+
+    commit = current_commit()
+    report = {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'latency': args.latency,
+        'results': results,
+    }
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print(compare(results, baseline).to_string(index=False, float_format=lambda x: f'{x:.3f}'))
+    print(f"\nresults saved to {output}", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
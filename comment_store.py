@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# fields kept for every comment, as returned by parse_comment (and parse_reply, which links a reply to the
+# comment_id of its thread in parent_id; top-level comments have no parent)
+COMMENT_COLUMNS = ['comment_id', 'video_id', 'channel_id', 'author_name', 'author_channel_id', 'like_count',
+                   'total_reply_count', 'published', 'updated', 'text_display', 'is_op', 'parent_id']
+
+# compact dtypes of the comment columns: the ids shared by the comments of a video or channel are categorical
+# (a small integer code per comment), the other strings live in Arrow buffers instead of a python object each
+COMMENT_DTYPES = {
+    'comment_id': 'string[pyarrow]',
+    'video_id': 'category',
+    'channel_id': 'category',
+    'author_name': 'string[pyarrow]',
+    'author_channel_id': 'string[pyarrow]',
+    'like_count': 'int64',
+    'total_reply_count': 'int64',
+    'published': 'string[pyarrow]',
+    'updated': 'string[pyarrow]',
+    'text_display': 'string[pyarrow]',
+    'is_op': 'int8',
+    'parent_id': 'string[pyarrow]',
+}
+
+# comments frame with the compact dtypes, ordered by video as in video_ids (e.g. the search order) when given
+def compact_comments(df, video_ids=None):
+    counts = [column for column in ['like_count', 'total_reply_count', 'is_op'] if column in df.columns]
+    df = df.assign(**{column: df[column].fillna(0) for column in counts})
+    df = df.astype({column: dtype for column, dtype in COMMENT_DTYPES.items() if column in df.columns})
+    if video_ids is not None:
+        df['video_id'] = df['video_id'].cat.set_categories(list(dict.fromkeys(video_ids)))
+        df = df.sort_values('video_id', kind='stable', ignore_index=True)
+    return df
+
+# Arrow strings and lists are kept as such when loading, everything else gets its usual pandas dtype
+def arrow_dtype(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype('pyarrow')
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+# save a comments frame as Parquet: categorical columns are dictionary-encoded and token columns stored as
+# Arrow lists. The pandas metadata is left out, so any Parquet reader gets plain columns back
+def save_comments(df, path):
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    pq.write_table(table, path)
+
+# load a comments frame saved by save_comments. The file is memory-mapped and the strings and token lists
+# stay in the Arrow buffers read from it, so no python object is created per comment
+def load_comments(path, columns=None):
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas(types_mapper=arrow_dtype)
+
+# identify a set of comments by their ids and last update, so an unchanged video can skip a new analysis
+def comments_fingerprint(comment_ids, updated):
+    pairs = sorted(f'{comment_id}@{update}' for comment_id, update in zip(comment_ids, updated))
+    return hashlib.sha256('\n'.join(pairs).encode('utf-8')).hexdigest()
+
+# local store of the comments of every video already harvested, used to refresh them incrementally:
+# the newest "published"/"updated" timestamp of the threads of each video is its high-water mark, so a
+# refresh only needs the threads that are newer than it (plus a bounded re-scan of the most recent known
+# threads, for their edits). The last analysis of each video is kept along with the
+# fingerprint of the comments it was made from.
+class CommentStore:
+    def __init__(self, path='.cache/comments.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS comments (
+            comment_id TEXT PRIMARY KEY,
+            video_id TEXT NOT NULL,
+            channel_id TEXT,
+            author_name TEXT,
+            author_channel_id TEXT,
+            like_count INTEGER,
+            total_reply_count INTEGER,
+            published TEXT,
+            updated TEXT,
+            text_display TEXT,
+            is_op INTEGER,
+            parent_id TEXT
+        )''')
+        # stores created before replies were harvested lack the parent link
+        if 'parent_id' not in [row[1] for row in self.conn.execute('PRAGMA table_info(comments)')]:
+            self.conn.execute('ALTER TABLE comments ADD COLUMN parent_id TEXT')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS comments_video_id ON comments (video_id)')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS analyses (
+            video_id TEXT NOT NULL,
+            search_query TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            result TEXT NOT NULL,
+            analyzed REAL NOT NULL,
+            PRIMARY KEY (video_id, search_query)
+        )''')
+        self.conn.commit()
+
+    # newest published/updated timestamp of the threads stored for each video (videos never harvested are
+    # left out). Replies don't count: a thread is only fetched again when it's newer than the mark
+    def high_water_marks(self, video_ids):
+        video_ids = list(video_ids)
+        marks = {}
+        with self.lock:
+            for i in range(0, len(video_ids), 500):
+                batch = video_ids[i:i + 500]
+                rows = self.conn.execute(
+                    f'''SELECT video_id, MAX(MAX(published), MAX(updated)) FROM comments
+                    WHERE video_id IN ({','.join('?' * len(batch))}) AND parent_id IS NULL GROUP BY video_id''', batch
+                ).fetchall()
+                marks.update(dict(rows))
+        return marks
+
+    # insert new comments and update the edited ones
+    def upsert(self, comments):
+        df = pd.DataFrame(comments, columns=COMMENT_COLUMNS)
+        with self.lock:
+            self.conn.executemany(
+                f'''INSERT INTO comments ({','.join(COMMENT_COLUMNS)}) VALUES ({','.join('?' * len(COMMENT_COLUMNS))})
+                ON CONFLICT(comment_id) DO UPDATE SET
+                    like_count = excluded.like_count,
+                    total_reply_count = excluded.total_reply_count,
+                    updated = excluded.updated,
+                    text_display = excluded.text_display
+                WHERE excluded.updated != comments.updated''',
+                df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            )
+            self.conn.commit()
+
+    # every stored comment of the given videos, most recent first
+    def load(self, video_ids):
+        video_ids = list(video_ids)
+        frames = []
+        with self.lock:
+            for i in range(0, len(video_ids), 500):
+                batch = video_ids[i:i + 500]
+                frames.append(pd.read_sql_query(
+                    f'''SELECT {','.join(COMMENT_COLUMNS)} FROM comments
+                    WHERE video_id IN ({','.join('?' * len(batch))}) ORDER BY video_id, published DESC''',
+                    self.conn, params=batch
+                ))
+        if len(frames) == 0:
+            return pd.DataFrame(columns=COMMENT_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    # last analysis of a video for a query, only if it was made from the same comments
+    def get_analysis(self, video_id, search_query, fingerprint):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT result FROM analyses WHERE video_id = ? AND search_query = ? AND fingerprint = ?',
+                (video_id, search_query, fingerprint)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set_analysis(self, video_id, search_query, fingerprint, result):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO analyses (video_id, search_query, fingerprint, result, analyzed) VALUES (?, ?, ?, ?, ?)',
+                (video_id, search_query, fingerprint, result, time.time())
+            )
+            self.conn.commit()
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sentiment_pipeline import save_results, load_results, save_comparison, load_comparison
+
+# how long (in seconds) a finished job keeps answering new submits of its key, as long as the comments it
+# fetched are kept in the response cache; after that the same search runs again and picks up new comments
+JOB_TTL = 60 * 60
+
+# what job_key produces; any other key (e.g. from a tampered URL) never reaches the filesystem
+JOB_KEY_PATTERN = re.compile(r'[0-9a-f]{16}')
+
+# identify a job by its query and the parameters that change its results (never the API keys),
+# so the same request made from any session is the same job
+def job_key(search_query, **params):
+    payload = json.dumps({'search_query': search_query, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+# a pipeline run in the background: its progress messages and partial results (see SentimentPipeline.run)
+# grow while it runs, and the results are set once it's done. Any thread can take a snapshot at any time.
+class Job:
+    def __init__(self, key, search_query, params):
+        self.key = key
+        self.search_query = search_query
+        self.params = params
+        self.status = 'running' # running, done or failed
+        self.messages = []
+        self.partial = {}
+        self.results = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    # on_progress callback of the pipeline
+    def progress(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+    # on_partial callback of the pipeline
+    def update(self, name, value):
+        with self.lock:
+            self.partial[name] = value
+
+    def finish(self, results):
+        with self.lock:
+            self.results = results
+            self.status = 'done'
+            self.finished = time.time()
+
+    def fail(self, err):
+        with self.lock:
+            self.error = str(err)
+            self.status = 'failed'
+            self.finished = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'key': self.key,
+                'search_query': self.search_query,
+                'status': self.status,
+                'messages': list(self.messages),
+                'partial': dict(self.partial),
+                'results': self.results,
+                'error': self.error,
+                'started': self.started,
+                'finished': self.finished,
+            }
+
+# runs pipeline jobs on a pool of background threads shared by every session. A job already running for
+# the same key, or finished less than ttl seconds ago, is reused instead of started again. Finished jobs
+# are saved into results_dir/<key>, so they survive restarts of the app and a page can reconnect to them
+# by key (however old they are). Only running jobs and the ones still within the ttl are kept in memory,
+# older ones are read back from disk when a page asks for them. Failed jobs are kept in memory only (until
+# the ttl), the next submit of the same key starts them over.
+class JobRunner:
+    def __init__(self, results_dir='.cache/jobs', max_workers=2, ttl=JOB_TTL):
+        self.results_dir = results_dir
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    # start run(job) in the background, returning its Job; run returns the pipeline's results
+    # (of SentimentPipeline.run or SentimentPipeline.compare)
+    def submit(self, key, search_query, params, run):
+        with self.lock:
+            self.prune()
+            job = self.jobs.get(key)
+            if job is not None and self.reusable(job):
+                return job
+
+            job = self.load(key)
+            if job is None or not self.reusable(job):
+                job = Job(key, search_query, params)
+                self.executor.submit(self.execute, job, run)
+            self.jobs[key] = job
+            return job
+
+    # a running job, or a finished one that isn't older than the ttl
+    def reusable(self, job):
+        if job.status == 'running':
+            return True
+        return job.status == 'done' and time.time() - job.finished < self.ttl
+
+    # drop the jobs (and their results) finished more than ttl seconds ago from memory; the successful
+    # ones are still on disk. Called with the lock held
+    def prune(self):
+        now = time.time()
+        for key, job in list(self.jobs.items()):
+            if job.status != 'running' and now - job.finished >= self.ttl:
+                del self.jobs[key]
+
+    # the job of a key, running or finished, or None if there's no such job
+    def get(self, key):
+        if not JOB_KEY_PATTERN.fullmatch(str(key)):
+            return None
+        with self.lock:
+            self.prune()
+            job = self.jobs.get(key)
+            if job is None:
+                job = self.load(key)
+                if job is not None and self.reusable(job):
+                    self.jobs[key] = job
+            return job
+
+    def execute(self, job, run):
+        try:
+            results = run(job)
+            self.save(job, results)
+            job.finish(results)
+        except Exception as err:
+            job.fail(err)
+
+    def job_dir(self, key):
+        if not JOB_KEY_PATTERN.fullmatch(str(key)):
+            raise ValueError(f'invalid job key: {key!r}')
+        return os.path.join(self.results_dir, key)
+
+    # write into a temporary directory first, so a half-saved job is never loaded
+    def save(self, job, results):
+        temp_dir = f'{self.job_dir(job.key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        comparison = 'search_queries' in results
+        if comparison:
+            save_comparison(results, temp_dir)
+        else:
+            save_results(results, temp_dir)
+        with open(os.path.join(temp_dir, 'job.json'), 'w', encoding='utf-8') as file:
+            json.dump({'key': job.key, 'search_query': job.search_query, 'params': job.params, 'comparison': comparison,
+                       'started': job.started, 'finished': time.time(), 'messages': job.messages},
+                      file, ensure_ascii=False, indent=2, default=str)
+        shutil.rmtree(self.job_dir(job.key), ignore_errors=True)
+        os.replace(temp_dir, self.job_dir(job.key))
+
+    # a finished job saved by an earlier run, or None
+    def load(self, key):
+        path = os.path.join(self.job_dir(key), 'job.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+
+        job = Job(key, data['search_query'], data['params'])
+        job.started = data['started']
+        job.messages = data['messages']
+        if data.get('comparison'):
+            job.finish(load_comparison(self.job_dir(key)))
+        else:
+            job.finish(load_results(self.job_dir(key), data['search_query']))
+        job.finished = data['finished']
+        return job
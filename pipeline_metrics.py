@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+# Youtube Data API quota cost of each list call
+QUOTA_UNITS = {
+    'search': 100,
+    'videos': 1,
+    'commentThreads': 1,
+    'comments': 1,
+}
+
+# counters recorded by the pipeline for each stage (and video, when the work belongs to one):
+# wall_seconds, calls, retries, bytes, quota_units, prompt_tokens, completion_tokens, comments...
+# All of them only ever go up, so stages running in several threads can add to them safely.
+class PipelineMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = defaultdict(lambda: defaultdict(float))
+        self.videos = defaultdict(lambda: defaultdict(float))
+        self.started = time.time()
+
+    def add(self, stage, video_id=None, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                self.stages[stage][name] += value
+                if video_id is not None:
+                    self.videos[video_id][name] += value
+
+    # time a block of code as a stage; "calls" counts how many times the stage ran
+    @contextmanager
+    def stage(self, stage, video_id=None):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(stage, video_id, wall_seconds=time.perf_counter() - start, calls=1)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started': self.started,
+                'stages': {stage: dict(counters) for stage, counters in self.stages.items()},
+                'videos': {video_id: dict(counters) for video_id, counters in self.videos.items()},
+                'totals': self.totals(),
+            }
+
+    def totals(self):
+        totals = defaultdict(float)
+        for counters in self.stages.values():
+            for name, value in counters.items():
+                if name != 'wall_seconds': # stages overlap in time, their wall times don't add up
+                    totals[name] += value
+        return dict(totals)
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    # metrics saved by to_dict/to_json, e.g. along with the results of an earlier run
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        metrics.started = data.get('started', metrics.started)
+        for stage, counters in data.get('stages', {}).items():
+            metrics.stages[stage].update(counters)
+        for video_id, counters in data.get('videos', {}).items():
+            metrics.videos[video_id].update(counters)
+        return metrics
+
+    # Prometheus text exposition format, one gauge per counter labelled by stage (and by video)
+    def to_prometheus(self, prefix='youtube_sentiment'):
+        data = self.to_dict()
+        lines = []
+        names = sorted({name for counters in data['stages'].values() for name in counters})
+        for name in names:
+            metric = f'{prefix}_stage_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for stage, counters in sorted(data['stages'].items()):
+                if name in counters:
+                    lines.append(f'{metric}{{stage="{stage}"}} {prometheus_value(counters[name])}')
+
+        names = sorted({name for counters in data['videos'].values() for name in counters})
+        for name in names:
+            metric = f'{prefix}_video_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for video_id, counters in sorted(data['videos'].items()):
+                if name in counters:
+                    lines.append(f'{metric}{{video_id="{video_id}"}} {prometheus_value(counters[name])}')
+        return '\n'.join(lines) + '\n'
+
+    # one row per stage (or per video), to be displayed as a table
+    def summary(self, per_video=False):
+        data = self.to_dict()['videos' if per_video else 'stages']
+        return pd.DataFrame.from_dict(data, orient='index').fillna(0).rename_axis('video_id' if per_video else 'stage')
+
+# a counter in the Prometheus text format, at full precision (counts, which add up as floats, as integers)
+def prometheus_value(value):
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+# record counters when metrics are being collected
+def record(metrics, stage, video_id=None, **counters):
+    if metrics is not None:
+        metrics.add(stage, video_id, **counters)
+
+# time a stage when metrics are being collected
+def timed(metrics, stage, video_id=None):
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(stage, video_id)
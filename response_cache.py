@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+# time to live (in seconds) of each type of cached call
+DEFAULT_TTLS = {
+    'search': 6 * 60 * 60,            # search results change throughout the day
+    'videos': 7 * 24 * 60 * 60,       # video title/description rarely change
+    'commentThreads': 60 * 60,        # new comments keep coming
+    'comments': 60 * 60,
+    'chat': 30 * 24 * 60 * 60,        # same prompt and model, same answer
+}
+DEFAULT_TTL = 24 * 60 * 60
+PURGE_INTERVAL = 60 # seconds between two purges of the expired entries
+
+# hash the prompts sent to the LLM, so the cache key doesn't carry whole comment lists around
+def hash_prompt(*parts):
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+# content-addressed cache for Youtube and OpenAI responses, persisted in a SQLite file so it
+# survives restarts and can be shared between workers. Entries expire according to their call
+# type and the least recently used ones are evicted once the file grows past max_bytes. The total size of
+# the entries is kept up to date by triggers, so it's right even when several processes write to the file.
+class ResponseCache:
+    def __init__(self, path='.cache/responses.sqlite', max_bytes=256 * 1024 * 1024, ttls=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.evictions = 0
+        self.next_purge = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL') # lets several processes read while one writes
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            call_type TEXT NOT NULL,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            last_access REAL NOT NULL
+        )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)')
+        # running total of the entry sizes (a cache created before it existed starts from the sum of its entries)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)')
+        self.conn.execute('INSERT OR IGNORE INTO cache_size (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM responses')
+        self.conn.execute('''CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses
+            BEGIN UPDATE cache_size SET bytes = bytes + new.size; END''')
+        self.conn.execute('''CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses
+            BEGIN UPDATE cache_size SET bytes = bytes + new.size - old.size; END''')
+        self.conn.execute('''CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses
+            BEGIN UPDATE cache_size SET bytes = bytes - old.size; END''')
+        self.conn.commit()
+
+    # build the cache key from the call type and everything that identifies the call
+    # (endpoint parameters, model, prompt hash...)
+    def make_key(self, call_type, params):
+        payload = json.dumps([call_type, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # return (True, value) for a live entry, (False, None) otherwise
+    def get(self, call_type, params):
+        key = self.make_key(call_type, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.misses[call_type] += 1
+                return False, None
+
+            self.conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.hits[call_type] += 1
+        return True, json.loads(row[0])
+
+    def set(self, call_type, params, value, ttl=None):
+        key = self.make_key(call_type, params)
+        value = json.dumps(value)
+        now = time.time()
+        if ttl is None:
+            ttl = self.ttls.get(call_type, DEFAULT_TTL)
+
+        with self.lock:
+            # an upsert rather than INSERT OR REPLACE, whose implicit delete wouldn't fire the size trigger
+            self.conn.execute(
+                '''INSERT INTO responses (key, call_type, value, size, expires, last_access) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET call_type = excluded.call_type, value = excluded.value, size = excluded.size,
+                    expires = excluded.expires, last_access = excluded.last_access''',
+                (key, call_type, value, len(value), now + ttl, now)
+            )
+            self.evict(now)
+            self.conn.commit()
+
+    # drop expired entries (every PURGE_INTERVAL seconds), then the least recently used ones until the cache
+    # fits in max_bytes
+    def evict(self, now):
+        if now >= self.next_purge:
+            self.evictions += self.conn.execute('DELETE FROM responses WHERE expires < ?', (now,)).rowcount
+            self.next_purge = now + PURGE_INTERVAL
+
+        total = self.conn.execute('SELECT bytes FROM cache_size').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # walk the entries from the oldest access, collecting keys until enough space is freed
+        to_free = total - self.max_bytes
+        keys = []
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            keys.append((key,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+        self.evictions += len(keys)
+
+    # return the cached value, or compute it, store it and return it
+    def get_or_set(self, call_type, params, compute, ttl=None):
+        hit, value = self.get(call_type, params)
+        if hit:
+            return value
+        value = compute()
+        self.set(call_type, params, value, ttl)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+
+    def stats(self):
+        call_types = sorted(set(self.hits) | set(self.misses))
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            size = self.conn.execute('SELECT bytes FROM cache_size').fetchone()[0]
+        return {
+            'entries': entries,
+            'bytes': size,
+            'evictions': self.evictions,
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'per_call_type': {
+                call_type: {'hits': self.hits[call_type], 'misses': self.misses[call_type]}
+                for call_type in call_types
+            },
+        }
+
+# run "compute" through the cache when one is given
+def cached(cache, call_type, params, compute, ttl=None):
+    if cache is None:
+        return compute()
+    return cache.get_or_set(call_type, params, compute, ttl)
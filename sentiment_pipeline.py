@@ -0,0 +1,1553 @@
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import nltk
+import emoji
+import re
+import hashlib
+import os
+import multiprocessing
+import sys
+import json
+import time
+import random
+import zlib
+import queue
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from collections import Counter, defaultdict
+from openai import OpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+from unidecode import unidecode
+from nltk.stem import WordNetLemmatizer
+from langdetect import detect, DetectorFactory
+from dotenv import load_dotenv
+from response_cache import ResponseCache, cached, hash_prompt
+from comment_store import CommentStore, COMMENT_COLUMNS, comments_fingerprint, compact_comments, save_comments, load_comments
+from pipeline_metrics import PipelineMetrics, record, timed
+from youtube_client import YoutubeClient, YoutubeApiError
+
+# settings
+DetectorFactory.seed = 42 # makes language detection deterministic
+
+# language pre-filter
+LANGUAGE_NOISE = re.compile(r'http\S+|\B@\w+|<[^>]*>|&\w+;') # links, mentions, html tags and entities
+LANGUAGE_WORDS = re.compile(r'[a-z]+')
+MIN_ASCII_RATIO = 0.6 # share of latin letters below which a comment can't be english
+MIN_MARKER_RATIO = 0.2 # share of ENGLISH_MARKERS words above which a comment is surely english
+# frequent english words that aren't also common words of other latin-script languages (unlike "a", "no",
+# "me", "so" or "do" from the stopword list, which spanish and portuguese comments are full of)
+ENGLISH_MARKERS = frozenset('''the and is are was were be been being you your this that these those with it its they
+their what which who have has had not but for from of at about would will should could just very really my our
+there here than then when why how because only also'''.split())
+MIN_WORDS = 3 # shorter comments are never sent to langdetect unless they have an english stopword
+
+# comment analysis
+CONTEXT_TOKENS = 4096 # context window of gpt-3.5-turbo
+COMPLETION_TOKENS = 512 # room left for the answer
+MAX_CHUNKS_PER_VIDEO = 8 # the least liked comments beyond this are not analyzed
+LLM_MAX_RETRIES = 4 # retries of a chat completion on rate limits and transient errors
+WORDCLOUD_TOP_WORDS = 200 # same as WordCloud's max_words, less frequent words are never drawn
+
+# local sentiment pre-classifier
+MIN_CONTENT_TOKENS = 3 # comments with fewer tokens and no sentiment word carry no opinion ("first!", "nice video")
+SENTIMENT_SAMPLE_SIZE = 200 # comments per video sent to the LLM, sampled across the local polarities
+
+# near-duplicate collapsing
+DEDUP_PERMUTATIONS = 64 # MinHash signature length
+DEDUP_BANDS = 16 # LSH bands of 4 rows: texts ~50% similar already have a good chance of meeting in a bucket
+DEDUP_THRESHOLD = 0.6 # estimated Jaccard similarity of word 2-grams above which two comments are the same
+                      # comment: changing a single word of a 20-word spam comment already takes it down to ~0.7
+
+# comment harvesting
+COMMENTS_PAGE_SIZE = 100 # maximum page size accepted by commentThreads().list
+MAX_COMMENTS_PER_VIDEO = 500 # comment budget per video
+EDIT_RESCAN_THREADS = 100 # already known threads still scanned by an incremental refresh, to pick up their edits
+SKIP_REASONS = {'commentsDisabled', 'videoNotFound', 'commentNotFound'} # videos (or threads) without available comments
+
+# reply expansion
+REPLIES_PAGE_SIZE = 100 # maximum page size accepted by comments().list
+MAX_REPLIES_PER_VIDEO = 200 # reply budget per video when replies are expanded, inline or fetched
+REPLY_MIN_COUNT = 5 # threads with at least this many replies...
+REPLY_MIN_LIKES = 50 # ...or this many likes get the rest of their replies fetched
+REPLY_WORKERS = 8 # concurrent comments().list calls, shared by every video of a harvest
+
+# function to load API key and start Youtube API, a single pooled client per key shared by every stage and run
+@lru_cache(maxsize=None)
+def load_api(api_key):
+    # Set up the API
+    youtube = YoutubeClient(api_key)
+    return youtube
+
+# OpenAI client (and its pool of connections) shared by every stage and run, per key.
+# chat_completion does its own retries with backoff, so the client doesn't retry on top of them
+@lru_cache(maxsize=None)
+def load_llm(api_key):
+    return OpenAI(api_key=api_key, max_retries=0)
+
+# function to open the persistent response cache shared by every run
+def load_cache(path='.cache/responses.sqlite'):
+    return ResponseCache(path)
+
+# send a prompt to the LLM and return the answer, reusing earlier answers for the same prompt and model
+# rate limits and transient errors are retried with exponential backoff
+# token usage, calls and retries are recorded under "stage" (and video_id) when metrics are given
+def chat_completion(cliente, prompt_sistema, prompt_user, max_tokens, model="gpt-3.5-turbo", cache=None,
+                    max_retries=LLM_MAX_RETRIES, base_delay=1.0, metrics=None, stage='llm', video_id=None):
+    def request():
+        for attempt in range(max_retries + 1):
+            try:
+                response = cliente.chat.completions.create(
+                    messages = [
+                        {
+                            "role":"system",
+                            "content":prompt_sistema
+                        },
+                        {
+                            "role":"user",
+                            "content":prompt_user
+                        }
+                    ],
+                    model=model,
+                    max_tokens=max_tokens
+                )
+                usage = getattr(response, 'usage', None)
+                record(metrics, stage, video_id, llm_calls=1,
+                       prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                       completion_tokens=getattr(usage, 'completion_tokens', 0) or 0)
+                return response.choices[0].message.content
+            except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError):
+                if attempt == max_retries:
+                    raise
+                record(metrics, stage, video_id, retries=1)
+                time.sleep(base_delay * (2 ** attempt) + random.uniform(0, base_delay))
+
+    params = {'model': model, 'max_tokens': max_tokens, 'prompt': hash_prompt(prompt_sistema, prompt_user)}
+    return cached(cache, 'chat', params, request)
+
+# function to search for videos based on search query (through the shared client of the key, unless one is given)
+def search_videos(search_query, max_results, api_key, cache=None, metrics=None, youtube=None):
+    try:
+        if max_results > 50: # Number of videos to retrieve
+            max_results = 50
+
+        youtube = youtube if youtube is not None else load_api(api_key)
+
+        params = {'q': search_query, 'maxResults': max_results}
+        data = cached(cache, 'search', params,
+                      lambda: youtube.search(search_query, max_results, metrics, relevanceLanguage='en'))
+
+        # Extract video IDs and URLs
+        video_data = []
+        for item in data['items']:
+            video_id = item['id']['videoId']
+            video_title = item['snippet']['title']
+            video_description = item['snippet']['description']
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            
+            # append to the list
+            video_data.append({
+                'video_id': video_id,
+                'video_title': video_title,
+                'video_description': video_description,
+                'video_url': video_url
+            })
+            
+        return pd.DataFrame(video_data)
+    except Exception as err:
+        raise Exception(' search_videos:' + str(err))
+
+# normalize the model's answer into one of the relevance labels
+def parse_relevance(text):
+    text = text.upper()
+    if "NOT RELEVANT" in text:
+        return "NOT RELEVANT"
+    if "RELEVANT" in text:
+        return "RELEVANT"
+    return None
+
+# classify a batch of videos with a single chat completion, returning {row index: label}
+def classify_batch(cliente, search_query, batch, cache=None, metrics=None):
+    prompt_sistema = f"""You are a marketing analyst skilled in evaluating the relevance of videos for product or topic analysis.
+    Given a video title and description, determine if the content is RELEVANT or NOT RELEVANT based on its value for marketing 
+    insights, research purposes, or general audience interest. Consider aspects such as alignment with the search term or 
+    expression, potential to engage or inform the target audience, and contribution to a comprehensive understanding of the 
+    topic. Your goal is to help filtering those videos so stakeholders can understand how their products or services are being 
+    received in the market. You will receive a "search_string" for a product or topic that will be researched, as well as a 
+    video title and its description. You should analyze each one of them and return only a single string with one of the options:
+    ["RELEVANT","NOT RELEVANT"]
+    """
+    if len(batch) > 1:
+        prompt_sistema += """You will receive several videos, each one starting with its ID between brackets, e.g. "[3]". Evaluate 
+    each video on its own and answer with one line per video, in the format "[ID]: RELEVANT" or "[ID]: NOT RELEVANT", and nothing else.
+    """
+
+    prompt_user = f"Search query: {search_query}\n"
+    for video_number, (_, item) in enumerate(batch, start=1):
+        if len(batch) > 1:
+            prompt_user += f"\n[{video_number}]\n"
+        prompt_user += f"Video title: {item['video_title']}\nVideo description: {item['video_description']}\n"
+
+    result = chat_completion(cliente, prompt_sistema, prompt_user, max_tokens=10 * len(batch), cache=cache,
+                             metrics=metrics, stage='classify_video')
+    if len(batch) == 1:
+        return {batch[0][0]: parse_relevance(result)}
+
+    # map every "[ID]: LABEL" line back to its dataframe row
+    labels = {}
+    for video_number, label in re.findall(r'\[?(\d+)\]?\s*[:\-]\s*(NOT RELEVANT|RELEVANT)', result, flags=re.IGNORECASE):
+        video_number = int(video_number)
+        if 1 <= video_number <= len(batch):
+            labels[batch[video_number - 1][0]] = label.upper()
+    return labels
+
+# function to classify video title as relevant or not
+# videos are packed "batch_size" at a time into each prompt, with up to "max_workers" requests in flight
+def classify_video(search_query, df_videos, api_key, batch_size=10, max_workers=4, cache=None, metrics=None):
+    try:
+        df_videos = df_videos.copy()
+        df_videos['relevance'] = None
+
+        # initialize client
+        cliente = load_llm(api_key)
+
+        rows = [(index, item) for index, item in df_videos.iterrows()]
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda batch: classify_batch(cliente, search_query, batch, cache, metrics), batches)
+            for labels in results:
+                for index, label in labels.items():
+                    df_videos.loc[index, 'relevance'] = label
+
+            # videos the model skipped in a batched answer are asked again one by one
+            missing = [(index, item) for index, item in rows if df_videos.loc[index, 'relevance'] is None]
+            if batch_size > 1 and len(missing) != 0:
+                results = executor.map(lambda row: classify_batch(cliente, search_query, [row], cache, metrics), missing)
+                for labels in results:
+                    for index, label in labels.items():
+                        df_videos.loc[index, 'relevance'] = label
+
+        return df_videos
+    except Exception as err:
+        raise Exception(' classify_video:' + str(err))
+
+# snippet of each video, from the cache when possible; the rest is looked up in videos().list calls of up to 50 ids
+def get_video_snippets(video_ids, youtube, cache=None, metrics=None):
+    snippets, missing = {}, []
+    for video_id in dict.fromkeys(video_ids):
+        hit, snippet = (False, None) if cache is None else cache.get('videos', {'id': video_id, 'part': 'snippet'})
+        if hit:
+            snippets[video_id] = snippet
+        else:
+            missing.append(video_id)
+
+    for item in youtube.videos(missing, metrics):
+        snippets[item['id']] = item['snippet']
+        if cache is not None:
+            cache.set('videos', {'id': item['id'], 'part': 'snippet'}, item['snippet'])
+    return snippets
+
+# function to add videos (a single url or a list of them) to the candidates list
+def add_videos(video_url, df_videos, api_key, cache=None, metrics=None, youtube=None):
+    try:
+        video_urls = [video_url] if isinstance(video_url, str) else list(video_url)
+        youtube = youtube if youtube is not None else load_api(api_key)
+
+        # extract the video ID from the URL
+        video_ids = [url.split('v=')[-1] for url in video_urls]
+        snippets = get_video_snippets(video_ids, youtube, cache, metrics)
+
+        # Append the new video information to the DataFrame
+        new_rows = [{
+            'video_id': video_id,
+            'video_title': snippets[video_id]['title'],
+            'video_description': snippets[video_id]['description'],
+            'video_url': url
+        } for video_id, url in zip(video_ids, video_urls) if video_id in snippets]
+        new_df = pd.DataFrame(new_rows)
+        df_videos = pd.concat([df_videos, new_df], axis=0, ignore_index=True)
+
+        return df_videos
+    except Exception as err:
+        raise Exception(' add_videos:' + str(err))
+
+# pre-processing
+# parse a single comment thread returned by the Youtube API into a flat dict
+def parse_comment(item):
+    snippet = item['snippet']
+    top_level = snippet['topLevelComment']['snippet']
+
+    comment = {} # a dict to store the results
+    comment['comment_id'] = item['id']
+    comment['video_id'] = snippet['videoId']
+    comment['channel_id'] = snippet['channelId']
+    comment['author_name'] = top_level['authorDisplayName']
+    comment['author_channel_id'] = top_level.get('authorChannelId', {}).get('value')
+    comment['like_count'] = top_level['likeCount']
+    comment['total_reply_count'] = snippet['totalReplyCount']
+    comment['published'] = top_level['publishedAt']
+    comment['updated'] = top_level['updatedAt']
+    comment['text_display'] = top_level['textDisplay']
+    comment['is_op'] = 1 if comment['author_channel_id']==comment['channel_id'] else 0
+    comment['parent_id'] = None
+    return comment
+
+# parse a reply (inline in a thread or returned by comments().list) into the same flat dict, linked to its thread
+def parse_reply(item, thread):
+    snippet = item['snippet']
+
+    comment = {}
+    comment['comment_id'] = item['id']
+    comment['video_id'] = thread['video_id']
+    comment['channel_id'] = thread['channel_id']
+    comment['author_name'] = snippet['authorDisplayName']
+    comment['author_channel_id'] = snippet.get('authorChannelId', {}).get('value')
+    comment['like_count'] = snippet['likeCount']
+    comment['total_reply_count'] = 0
+    comment['published'] = snippet['publishedAt']
+    comment['updated'] = snippet['updatedAt']
+    comment['text_display'] = snippet['textDisplay']
+    comment['is_op'] = 1 if comment['author_channel_id']==comment['channel_id'] else 0
+    comment['parent_id'] = thread['comment_id']
+    return comment
+
+# get the comments from a SINGLE video page by page, following nextPageToken up to max_comments.
+# With "since" (a high-water mark timestamp) the threads come newest first (by publish time) and only the
+# ones published or updated after it are kept. Edited threads can be older than the newest known one, so
+# paging goes on past it through up to "rescan" known threads (the most recent ones, the likeliest to be
+# edited) and stops there: edits to older threads are only picked up by a full harvest.
+# With "replies" the replies returned inline with each thread (a few of them, at no extra cost) follow it
+# in the page; they don't count against max_comments.
+def iter_comment_pages(video_id, youtube, max_comments=MAX_COMMENTS_PER_VIDEO, cache=None, since=None, metrics=None,
+                       replies=False, rescan=EDIT_RESCAN_THREADS):
+    fetched = 0
+    known = 0 # threads published before "since" scanned so far
+    page_token = None
+
+    while fetched < max_comments:
+        params = {
+            'part': "snippet,replies" if replies else "snippet",
+            'videoId': video_id,
+            'maxResults': min(COMMENTS_PAGE_SIZE, max_comments - fetched),
+            'pageToken': page_token
+        }
+        if since is not None:
+            params['order'] = "time"
+
+        try:
+            response = cached(cache, 'commentThreads', params,
+                              lambda: youtube.comment_threads(params, metrics, video_id=video_id))
+        except YoutubeApiError as err:
+            # videos with disabled comments (or removed meanwhile) simply have no comments
+            if err.reason in SKIP_REASONS:
+                return
+            raise
+
+        items = response.get('items', [])[:max_comments - fetched]
+        threads = [parse_comment(item) for item in items]
+        reached_known = False
+        if since is not None:
+            new_threads = [i for i, thread in enumerate(threads) if max(thread['published'], thread['updated']) > since]
+            known += sum(thread['published'] <= since for thread in threads)
+            reached_known = known != 0 and known >= rescan
+            items, threads = [items[i] for i in new_threads], [threads[i] for i in new_threads]
+
+        fetched += len(threads)
+        record(metrics, 'get_comments', video_id, comments=len(threads))
+
+        comments = []
+        for item, thread in zip(items, threads):
+            comments.append(thread)
+            if replies:
+                comments.extend(parse_reply(reply, thread) for reply in item.get('replies', {}).get('comments', []))
+        if len(comments) != 0:
+            yield comments
+
+        page_token = response.get('nextPageToken')
+        if page_token is None or reached_known:
+            return
+
+# get the replies of a SINGLE thread page by page, up to max_replies, leaving out the ones already known
+# (the ids of the replies that came inline with the thread)
+def iter_reply_pages(thread, youtube, max_replies, cache=None, metrics=None, known=()):
+    fetched = 0
+    page_token = None
+
+    while fetched < max_replies:
+        params = {
+            'part': "snippet",
+            'parentId': thread['comment_id'],
+            'maxResults': min(REPLIES_PAGE_SIZE, max_replies - fetched + len(known)),
+            'pageToken': page_token
+        }
+
+        try:
+            response = cached(cache, 'comments', params,
+                              lambda: youtube.comments(params, metrics, video_id=thread['video_id']))
+        except YoutubeApiError as err:
+            # threads removed meanwhile simply have no replies
+            if err.reason in SKIP_REASONS:
+                return
+            raise
+
+        replies = [parse_reply(item, thread) for item in response.get('items', []) if item['id'] not in known]
+        replies = replies[:max_replies - fetched]
+        fetched += len(replies)
+        record(metrics, 'get_replies', thread['video_id'], replies=len(replies))
+        if len(replies) != 0:
+            yield replies
+
+        page_token = response.get('nextPageToken')
+        if page_token is None:
+            return
+
+# whether the rest of the replies of a thread are worth fetching: it's discussed or liked enough and has
+# more replies than the ones that came inline with it
+def wants_replies(thread, n_inline, min_replies=REPLY_MIN_COUNT, min_likes=REPLY_MIN_LIKES):
+    if thread['total_reply_count'] <= n_inline:
+        return False
+    return thread['total_reply_count'] >= min_replies or thread['like_count'] >= min_likes
+
+# get all comments from a SINGLE video and save them into a list
+def get_comments(video_id, youtube, max_comments=MAX_COMMENTS_PER_VIDEO, cache=None, metrics=None):
+    try:
+        comments = []
+        for page in iter_comment_pages(video_id, youtube, max_comments, cache=cache, metrics=metrics):
+            comments.extend(page)
+
+        return comments
+    except Exception as err:
+        raise Exception(' get_comments:' + str(err))
+
+# get the comments from MANY videos concurrently, yielding (video_id, page) as soon as each page arrives
+# "since" optionally maps video ids to their high-water mark (see iter_comment_pages)
+# With max_replies > 0 up to that many replies per video are harvested too: the inline ones first, then the
+# rest of the replies of the threads picked by wants_replies. Those are fetched by a separate pool of
+# reply_workers shared by every video, as soon as their thread's page arrives, so a reply-heavy video keeps
+# paging its threads while its replies come in instead of fetching them one thread after another.
+def harvest_comments(video_ids, youtube, max_comments=MAX_COMMENTS_PER_VIDEO, max_workers=8, cache=None, since=None,
+                     metrics=None, max_replies=0, reply_workers=REPLY_WORKERS):
+    pages = queue.Queue()
+    done = object() # sentinel put on the queue when a video is finished
+
+    def reply_worker(video_id, thread, n_replies, known):
+        for page in iter_reply_pages(thread, youtube, n_replies, cache=cache, metrics=metrics, known=known):
+            pages.put((video_id, page))
+
+    # the workers share the client's pool of connections
+    def worker(video_id):
+        reply_futures = []
+        try:
+            video_since = None if since is None else since.get(video_id)
+            budget = max_replies # replies still allowed for this video; reserved when a fetch is scheduled
+            for page in iter_comment_pages(video_id, youtube, max_comments, cache=cache, since=video_since, metrics=metrics,
+                                           replies=max_replies > 0):
+                # inline replies are kept while the budget lasts
+                inline = defaultdict(set)
+                comments = []
+                for comment in page:
+                    if comment['parent_id'] is not None:
+                        if budget <= 0:
+                            continue
+                        budget -= 1
+                        inline[comment['parent_id']].add(comment['comment_id'])
+                    comments.append(comment)
+                record(metrics, 'get_comments', video_id, replies=sum(len(ids) for ids in inline.values()))
+                pages.put((video_id, comments))
+
+                for thread in comments:
+                    if budget <= 0:
+                        break
+                    known = inline[thread['comment_id']]
+                    if thread['parent_id'] is None and wants_replies(thread, len(known)):
+                        n_replies = min(budget, thread['total_reply_count'] - len(known))
+                        budget -= n_replies
+                        reply_futures.append(reply_executor.submit(reply_worker, video_id, thread, n_replies, known))
+
+            # the video is done once its replies are in
+            for future in reply_futures:
+                future.result()
+        finally:
+            for future in reply_futures:
+                future.cancel()
+            pages.put((video_id, done))
+
+    video_ids = list(dict.fromkeys(video_ids))
+    with ThreadPoolExecutor(max_workers=max(1, reply_workers)) as reply_executor, \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(worker, video_id) for video_id in video_ids]
+
+        pending = len(futures)
+        while pending > 0:
+            video_id, page = pages.get()
+            if page is done:
+                pending -= 1
+            else:
+                yield video_id, page
+
+        # surface any error raised inside the workers
+        for future in futures:
+            future.result()
+
+# obtain comments for ALL the videos (except "NOT RELEVANT" ones) and save into a compact dataframe (see compact_comments).
+# With a comment store the harvest is incremental: only threads newer than what is stored, or recently
+# edited (see iter_comment_pages), are fetched (bypassing the response cache), merged into the store, and
+# the stored comments are returned.
+# With max_replies > 0 the replies of the most discussed threads are included, linked by parent_id (see harvest_comments).
+def get_video_comments(df_videos, youtube, max_comments=MAX_COMMENTS_PER_VIDEO, max_workers=8, on_page=None, cache=None,
+                       store=None, metrics=None, max_replies=0):
+    try:
+        df_relevant = df_videos[df_videos['relevance'] != "NOT RELEVANT"]
+        videos = df_relevant.drop_duplicates('video_id').set_index('video_id')
+
+        since = None
+        if store is not None:
+            since = store.high_water_marks(videos.index)
+            cache = None
+
+        # collect the pages as they stream in
+        comments = []
+        for video_id, page in harvest_comments(videos.index, youtube, max_comments, max_workers, cache, since, metrics,
+                                                  max_replies=max_replies):
+            comments.extend(page)
+            if on_page is not None:
+                on_page(video_id, len(page))
+
+        if store is not None:
+            store.upsert(comments)
+            df_videos_comments = store.load(videos.index)
+        else:
+            df_videos_comments = pd.DataFrame(comments, columns=COMMENT_COLUMNS)
+
+        # the video details stay in df_videos (joined by video_id when needed), comments keep the search order
+        return compact_comments(df_videos_comments, videos.index)
+    except Exception as err:
+        raise Exception(' get_video_comments:' + str(err))
+
+# obtain stopwords
+def get_stopwords():
+    stopwords = nltk.corpus.stopwords.words('english')
+    stopwords = list(set([unidecode(word) for word in stopwords])) # remove accentuation
+    stopwords.extend(['href', 'quot', 'br', 'u', 'r', 'lt', 'b'])
+    stopwords = list(set([unidecode(word) for word in stopwords]))
+
+    return stopwords
+
+# Function to detect the language (DetectorFactory.seed is fixed once in the settings)
+def detect_language(text):
+    try:
+        return detect(text)
+    except:
+        return 'unknown'
+
+# keyboard emoticons and the token each one is standardized into
+HAPPY_FACES = [' :D',' :)',' (:',' =D',' =)',' (=',' ;D',' ;)',' :-)',' ;-)',' ;-D',' :-D']
+SAD_FACES = [' D:',' :(',' ):',' =(',' D=',' )=',' ;(',' D;', ' )-:',' )-;',' D-;',' D-:',' :/',' :-/', ' =/']
+NEUTRAL_FACES = [' :P',' :*','=P',' =S',' =*',' ;*',' :-|',' :-*',' =-P',' =-S']
+
+# pre-processing engine, built once and reused for every comment: regexes are compiled up front,
+# stopwords live in a frozenset, all emoticons are replaced in a single scan and lemmas are memoized
+class PreprocessingEngine:
+    def __init__(self, stopwords=None, lemmatizer=None):
+        self.stopwords = frozenset(get_stopwords() if stopwords is None else stopwords)
+        self.lemmatize = lru_cache(maxsize=None)((lemmatizer or WordNetLemmatizer()).lemmatize)
+
+        # numbers are removed on their own first, so mentions glued to a number are still caught by \B
+        self.numbers = re.compile(r'\d')
+        self.mentions_links = re.compile(r'\B@\w*[a-zA-Z]+\w*|http\S+')
+        self.special_chars = re.compile(r"[^a-zA-Z0-9_]+")
+        self.laughs = re.compile(r'\w*(?:haha|lol)\w*')
+        self.repeated_chars = re.compile(r'(\w)\1(\1+)')
+        # the contractions word_tokenize (Treebank rules) splits in two, the only ones that can still show up
+        # after normalize; the other Treebank rules only deal with punctuation and quotes, already gone by then
+        self.contractions = re.compile(r'\b(?:(can)(not)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me))\b|\b(wan)(na)(?=\s|$)')
+
+        # a single alternation of every emoticon, longest first, works as the Aho-Corasick automaton
+        self.emoticons = {}
+        for faces, replacement in [(HAPPY_FACES, ' happy_face '), (SAD_FACES, ' sad_face '), (NEUTRAL_FACES, ' neutral_face ')]:
+            for face in faces:
+                self.emoticons.setdefault(face, replacement)
+        self.emoticon_pattern = re.compile('|'.join(re.escape(face) for face in sorted(self.emoticons, key=len, reverse=True)))
+
+    def replace_emoticons(self, string):
+        return self.emoticon_pattern.sub(lambda match: self.emoticons[match.group(0)], string)
+
+    # clean a comment up to the point where it is ready to be split into tokens
+    def normalize(self, string):
+        string = self.numbers.sub('', string)
+        string = self.mentions_links.sub('', string)
+        string = emoji.demojize(string)
+        string = self.replace_emoticons(string)
+        string = unidecode(string)
+        string = self.special_chars.sub(' ', string).lower()
+        string = self.laughs.sub('hahaha', string)
+        string = self.repeated_chars.sub(r'\1', string)
+        return string
+
+    def split_contraction(self, match):
+        return ' ' + ' '.join(group for group in match.groups() if group is not None) + ' '
+
+    # only [a-z0-9_] and spaces are left after normalize, where word_tokenize is the same as splitting
+    # the contractions and then the spaces
+    def transform(self, string):
+        string = self.contractions.sub(self.split_contraction, self.normalize(string))
+        return [self.lemmatize(w) for w in string.split() if w not in self.stopwords]
+
+    # pre-process a whole column of comments at once, returning a token list column (see token_array) with the same index
+    def transform_batch(self, series):
+        series = series.fillna('').astype(str)
+
+        # repeated comments (copy-paste, spam) are only processed once
+        codes, distinct = pd.factorize(series)
+        texts = pd.Series(distinct, dtype=object)
+        texts = texts.str.replace(self.numbers, '', regex=True)
+        texts = texts.str.replace(self.mentions_links, '', regex=True)
+        texts = texts.map(emoji.demojize)
+        texts = texts.str.replace(self.emoticon_pattern, lambda match: self.emoticons[match.group(0)], regex=True)
+        texts = texts.map(unidecode)
+        texts = texts.str.replace(self.special_chars, ' ', regex=True).str.lower()
+        texts = texts.str.replace(self.laughs, 'hahaha', regex=True)
+        texts = texts.str.replace(self.repeated_chars, r'\1', regex=True)
+        texts = texts.str.replace(self.contractions, self.split_contraction, regex=True)
+
+        # one row per token: stopwords are filtered and lemmas looked up once per distinct word
+        tokens = texts.str.split().explode().dropna()
+        tokens = tokens[~tokens.isin(self.stopwords)]
+        lemmas = {word: self.lemmatize(word) for word in tokens.unique()}
+        tokens = tokens.map(lemmas)
+
+        # explode keeps the tokens of each distinct text together and in order: they are already the flat
+        # array, only the offsets where each text starts are missing. Every row then takes its text's tokens
+        lengths = tokens.groupby(level=0).size().reindex(texts.index, fill_value=0).to_numpy()
+        offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]), type=pa.int32())
+        distinct_tokens = pa.ListArray.from_arrays(offsets, pa.array(tokens.to_numpy(dtype=object), type=pa.string()))
+        return tokens_series(distinct_tokens.take(pa.array(codes)), series.index)
+
+# pre-processed tokens are kept in an Arrow list column: the tokens of every comment in a single flat array,
+# plus the offsets where each comment starts, instead of a python list (and its strings) per comment
+TOKENS_TYPE = pa.list_(pa.string())
+
+# token lists as a single Arrow list array, from a token column or from any sequence of lists (None for none)
+def token_array(token_lists):
+    if isinstance(token_lists, pd.Series):
+        token_lists = token_lists.array
+    if isinstance(token_lists, pd.arrays.ArrowExtensionArray):
+        token_lists = pa.array(token_lists)
+    if isinstance(token_lists, pa.ChunkedArray):
+        return pa.chunked_array(token_lists.chunks, type=TOKENS_TYPE).combine_chunks()
+    if isinstance(token_lists, pa.Array):
+        return token_lists
+    return pa.array(list(token_lists), type=TOKENS_TYPE)
+
+# an Arrow list array as a token column
+def tokens_series(tokens, index=None):
+    return pd.Series(pd.arrays.ArrowExtensionArray(tokens), index=index)
+
+# build the pre-processing engine only once per process
+@lru_cache(maxsize=None)
+def get_preprocessing_engine():
+    return PreprocessingEngine()
+
+# subfunction to idenify emoticons made with keyboard keys
+def find_emoticons(string):
+    return get_preprocessing_engine().replace_emoticons(string)
+
+# pre-processing function - pipeline
+def preprocessing(string):
+    try:
+        return get_preprocessing_engine().transform(string)
+    except Exception as err:
+        raise Exception(' preprocessing:' + str(err))
+
+# english stopwords used by the cheap language pre-filter
+@lru_cache(maxsize=None)
+def get_english_stopwords():
+    return frozenset(unidecode(word).replace("'", '') for word in nltk.corpus.stopwords.words('english'))
+
+# normalize a comment for language detection: lowercase, without links, mentions and extra spaces
+def normalize_for_language(text):
+    text = LANGUAGE_NOISE.sub(' ', str(text).lower())
+    return ' '.join(text.split())
+
+# tiered language detection: the ASCII ratio, the share of distinctively english words (ENGLISH_MARKERS) and
+# the length settle most comments right away, and only the ambiguous ones go through langdetect. Memoized per
+# normalized text.
+@lru_cache(maxsize=100000)
+def detect_language_tiered(text):
+    letters = [char for char in text if char.isalpha()]
+    if len(letters) == 0:
+        return 'unknown' # emojis, numbers or punctuation only
+
+    ascii_ratio = sum(char.isascii() for char in letters) / len(letters)
+    if ascii_ratio < MIN_ASCII_RATIO:
+        return 'other' # mostly non-latin script
+
+    words = LANGUAGE_WORDS.findall(text.replace("'", ''))
+    marker_ratio = sum(word in ENGLISH_MARKERS for word in words) / max(len(words), 1)
+    if ascii_ratio == 1 and marker_ratio >= MIN_MARKER_RATIO and len(words) >= MIN_WORDS:
+        return 'en'
+    if len(words) < MIN_WORDS and not any(word in get_english_stopwords() for word in words):
+        return 'unknown' # too short for any detector to be reliable
+
+    return detect_language(text)
+
+# only consider english comments
+def filter_english(df):
+    texts = df['text_display'].fillna('').map(normalize_for_language)
+    languages = {text: detect_language_tiered(text) for text in texts.unique()}
+    df = df.assign(language=texts.map(languages).astype('category'))
+    df = df[df['language'] == 'en'].copy()
+    return df
+
+# prepare each worker process: fixed language detection seed and a ready pre-processing engine
+def init_preprocessing_worker():
+    DetectorFactory.seed = 42
+    get_preprocessing_engine()
+
+# detect the language of a chunk of comments and pre-process the english ones, returning
+# the language of every comment and the tokens of the english ones
+def process_comments_chunk(texts):
+    languages = [detect_language_tiered(normalize_for_language(text)) for text in texts]
+    english = pd.Series([text for text, language in zip(texts, languages) if language == 'en'], dtype=object)
+    return languages, token_array(get_preprocessing_engine().transform_batch(english))
+
+# start method of the pre-processing processes: the pipeline runs inside multi-threaded processes (the app,
+# the job runner, the connection pools), which are unsafe to fork, so workers are started fresh instead
+# ("forkserver", or "spawn" where it's not available) and init_preprocessing_worker rebuilds their state
+def get_process_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+# language detection + pre-processing split in chunks over a process pool (one process per core by default);
+# chunks are reassembled in the original order, so the result is the same as running it serially
+# word frequencies, when given, are fed chunk by chunk as the results arrive
+def parallel_preprocessing(df, n_jobs=None, chunk_size=2000, frequencies=None):
+    try:
+        n_jobs = n_jobs or os.cpu_count() or 1
+        texts = df['text_display'].fillna('').astype(str).tolist()
+        video_ids = df['video_id'].tolist()
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+        def collect(chunk_results):
+            results = []
+            for i, (languages, tokens) in enumerate(chunk_results):
+                if frequencies is not None:
+                    chunk_video_ids = video_ids[i * chunk_size:(i + 1) * chunk_size]
+                    frequencies.update(tokens, [video_id for video_id, language in zip(chunk_video_ids, languages) if language == 'en'])
+                results.append((languages, tokens))
+            return results
+
+        if n_jobs == 1 or len(chunks) <= 1:
+            results = collect(process_comments_chunk(chunk) for chunk in chunks)
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks)), mp_context=get_process_context(),
+                                     initializer=init_preprocessing_worker) as executor:
+                results = collect(executor.map(process_comments_chunk, chunks))
+
+        df = df.assign(language=pd.Categorical([language for languages, _ in results for language in languages]))
+        df = df[df['language'] == 'en'].copy()
+        df['text_filtered'] = tokens_series(pa.chunked_array([tokens for _, tokens in results], type=TOKENS_TYPE).combine_chunks(),
+                                            df.index)
+        return df
+    except Exception as err:
+        raise Exception(' parallel_preprocessing:' + str(err))
+
+# word frequencies accumulated incrementally while the comments are pre-processed, overall and per video,
+# so the wordcloud never needs the whole token column concatenated in memory
+class WordFrequencies:
+    def __init__(self):
+        self.total = Counter()
+        self.per_video = defaultdict(Counter)
+
+    # add the tokens of some comments (see token_array) along with their video ids. The flat tokens are
+    # counted per video by Arrow, so the counters only see each distinct (video, word) pair once
+    def update(self, token_lists, video_ids):
+        tokens = token_array(token_lists)
+        words = pc.list_flatten(tokens)
+        if len(words) == 0:
+            return
+
+        video_codes, videos = pd.factorize(pd.Series(video_ids))
+        video_codes = video_codes[pc.list_parent_indices(tokens).to_numpy()]
+        counts = pa.table({'video': video_codes, 'word': words}).group_by(['video', 'word']).aggregate([([], 'count_all')])
+        for video, group in counts.to_pandas().groupby('video', sort=False):
+            video_counts = dict(zip(group['word'], group['count_all']))
+            self.total.update(video_counts)
+            self.per_video[videos[video]].update(video_counts)
+
+    # frequencies of the words of some of the videos only
+    def subset(self, video_ids):
+        frequencies = WordFrequencies()
+        for video_id in dict.fromkeys(video_ids):
+            if video_id in self.per_video:
+                frequencies.per_video[video_id] = self.per_video[video_id].copy()
+                frequencies.total.update(self.per_video[video_id])
+        return frequencies
+
+    # the k most frequent words as a {word: count} dict, overall or for a single video
+    def top(self, k=None, video_id=None):
+        counter = self.total if video_id is None else self.per_video.get(video_id, Counter())
+        return dict(counter.most_common(k))
+
+# render the wordcloud of a {word: count} table into a PNG, reusing the image already rendered for the same table.
+# wordcloud is only imported when an image is actually drawn, so headless runs don't need it
+def render_wordcloud(frequencies, cache_dir='.cache/wordclouds'):
+    key = hashlib.sha256(json.dumps(sorted(frequencies.items())).encode('utf-8')).hexdigest()
+    path = os.path.join(cache_dir, f'{key}.png')
+
+    if not os.path.exists(path):
+        from wordcloud import WordCloud
+
+        os.makedirs(cache_dir, exist_ok=True)
+        wordcloud = (WordCloud(width = 2000,
+                            height = 1000,
+                            random_state=42,
+                            background_color='white',
+                            colormap='Set2',
+                            collocations=False)
+                    .generate_from_frequencies(frequencies)
+                    )
+        # write to a temporary file first, so concurrent sessions never read a half-written image
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        wordcloud.to_image().save(temp_path, format='PNG')
+        os.replace(temp_path, path)
+
+    return path
+
+# stable 32-bit hashes of the word 2-grams (single words for one-word comments) of a pre-processed comment
+def shingle_hashes(text):
+    words = text.split()
+    shingles = [' '.join(words[i:i + 2]) for i in range(max(len(words) - 1, 1))] if len(words) != 0 else []
+    return [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+
+# MinHash signatures (one row per text, DEDUP_PERMUTATIONS columns) computed with numpy over batches of texts
+def minhash_signatures(texts, batch_size=2000):
+    rng = np.random.default_rng(42)
+    a = rng.integers(1, 2 ** 31, DEDUP_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 31, DEDUP_PERMUTATIONS, dtype=np.uint64)
+    prime = np.uint64(4294967311) # first prime above 2**32, a * x + b never overflows 64 bits
+
+    signatures = np.empty((len(texts), DEDUP_PERMUTATIONS), dtype=np.uint64)
+    for start in range(0, len(texts), batch_size):
+        hashes = [shingle_hashes(text) for text in texts[start:start + batch_size]]
+        lengths = np.array([len(h) for h in hashes])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        values = np.fromiter((x for h in hashes for x in h), dtype=np.uint64, count=lengths.sum())
+
+        permuted = (values[:, None] * a + b) % prime
+        signatures[start:start + len(hashes)] = np.minimum.reduceat(permuted, offsets, axis=0) if len(values) else 0
+    return signatures
+
+# collapse spam, bot replies and copy-pasted comments of each video into a single representative (the most
+# liked one) with a "duplicate_count". Near-duplicates are found with MinHash + LSH over the tokens: texts
+# sharing a band of their signature become candidates, and are merged when their estimated Jaccard similarity
+# of word 2-grams reaches threshold. No pairwise comparison, so it scales to hundreds of thousands of comments
+def collapse_duplicates(df, threshold=DEDUP_THRESHOLD):
+    try:
+        df = df.reset_index(drop=True)
+        df['like_count'] = pd.to_numeric(df['like_count'], errors='coerce').fillna(0)
+        texts = pc.fill_null(pc.binary_join(token_array(df['text_filtered']), ' '), '').to_pylist()
+        has_text = np.array([len(text.split()) != 0 for text in texts])
+        rows = np.flatnonzero(has_text) # comments left empty by the pre-processing are never merged
+
+        parent = np.arange(len(df))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        if len(rows) > 1:
+            signatures = minhash_signatures([texts[i] for i in rows])
+            video_codes = pd.factorize(df['video_id'].iloc[rows])[0].astype(np.uint64)
+            rows_per_band = DEDUP_PERMUTATIONS // DEDUP_BANDS
+
+            for band in range(DEDUP_BANDS):
+                # fold the video and the band rows into a single 64-bit bucket key (collisions are caught by the similarity check)
+                buckets = video_codes.copy()
+                for column in signatures[:, band * rows_per_band:(band + 1) * rows_per_band].T:
+                    buckets = buckets * np.uint64(1099511628211) ^ column
+
+                # compare every member of a bucket with its first member only
+                order = np.argsort(buckets, kind='stable')
+                starts = np.flatnonzero(np.r_[True, buckets[order][1:] != buckets[order][:-1]])
+                ends = np.r_[starts[1:], len(order)]
+                shared = ends - starts > 1
+                for head, end in zip(starts[shared], ends[shared]):
+                    first = order[head]
+                    members = order[head + 1:end]
+                    similarity = (signatures[members] == signatures[first]).mean(axis=1)
+                    for member in members[similarity >= threshold]:
+                        root_a, root_b = find(rows[first]), find(rows[member])
+                        if root_a != root_b:
+                            parent[root_b] = root_a
+
+        df['duplicate_group'] = [find(i) for i in range(len(df))]
+        df['duplicate_count'] = df.groupby('duplicate_group')['duplicate_group'].transform('size')
+        df = df.sort_values('like_count', ascending=False, kind='stable').drop_duplicates('duplicate_group')
+        return df.sort_index().drop(columns='duplicate_group')
+    except Exception as err:
+        raise Exception(' collapse_duplicates:' + str(err))
+
+# sentiment lexicon over the pre-processed tokens (lowercase, lemmatized, emojis and emoticons already
+# turned into words such as "thumbs_up" or "happy_face"). Stopwords like "not" are gone by then, so this
+# is only a rough polarity used to filter and sample comments, the LLM still makes the final call
+SENTIMENT_LEXICON = {
+    **dict.fromkeys(['good', 'great', 'awesome', 'amazing', 'excellent', 'love', 'loved', 'loving', 'like', 'liked', 'best',
+                     'perfect', 'nice', 'cool', 'beautiful', 'impressive', 'impressed', 'fantastic', 'wonderful', 'recommend',
+                     'recommended', 'worth', 'happy', 'glad', 'useful', 'helpful', 'fast', 'smooth', 'solid', 'easy', 'comfortable',
+                     'quality', 'favorite', 'favourite', 'incredible', 'brilliant', 'superb', 'enjoy', 'enjoyed', 'win', 'better',
+                     'hahaha', 'happy_face', 'thumbs_up', 'red_heart', 'fire', 'smiling_face_with_heart_eyes',
+                     'face_with_tears_of_joy', 'clapping_hands', 'star_struck'], 1),
+    **dict.fromkeys(['bad', 'worst', 'terrible', 'awful', 'horrible', 'hate', 'hated', 'poor', 'disappointed', 'disappointing',
+                     'disappointment', 'broken', 'broke', 'problem', 'issue', 'bug', 'expensive', 'overpriced', 'slow', 'useless',
+                     'waste', 'wasted', 'annoying', 'ugly', 'fake', 'scam', 'cheap', 'junk', 'garbage', 'trash', 'suck', 'sucks',
+                     'fail', 'failed', 'worse', 'refund', 'returned', 'regret', 'uncomfortable', 'laggy', 'lag', 'crash', 'boring',
+                     'sad_face', 'thumbs_down', 'pouting_face', 'angry_face', 'nauseated_face', 'face_vomiting', 'pile_of_poo'], -1),
+}
+
+# score every comment with the lexicon, vectorized over the flat tokens. Adds "polarity_score" (sum of the
+# word scores), "polarity" (POSITIVE/NEGATIVE/NEUTRAL) and "content_free" (no opinion worth sending to the LLM)
+def score_sentiment(df, lexicon=SENTIMENT_LEXICON):
+    try:
+        df = df.copy()
+        tokens = token_array(df['text_filtered'])
+        rows = pc.list_parent_indices(tokens).to_numpy()
+        positions = pc.index_in(pc.list_flatten(tokens), value_set=pa.array(list(lexicon), type=pa.string()))
+        hits = positions.is_valid().to_numpy(zero_copy_only=False)
+        scores = np.array(list(lexicon.values()), dtype=float)[pc.fill_null(positions, 0).to_numpy()[hits]]
+
+        n_tokens = pc.fill_null(pc.list_value_length(tokens), 0).to_numpy()
+        n_hits = np.bincount(rows[hits], minlength=len(df))
+        polarity_score = np.bincount(rows[hits], weights=scores, minlength=len(df))
+
+        df['polarity_score'] = polarity_score
+        df['polarity'] = pd.Categorical(np.select([polarity_score > 0, polarity_score < 0], ['POSITIVE', 'NEGATIVE'], 'NEUTRAL'))
+        df['content_free'] = (n_tokens < MIN_CONTENT_TOKENS) & (n_hits == 0)
+        return df
+    except Exception as err:
+        raise Exception(' score_sentiment:' + str(err))
+
+# representative sample of a video's comments for the LLM: every local polarity keeps its share
+# of the sample, filled with its most liked comments
+def sample_comments(group, sample_size=SENTIMENT_SAMPLE_SIZE):
+    if sample_size is None or len(group) <= sample_size:
+        return group
+
+    group = group.assign(like_count=pd.to_numeric(group['like_count'], errors='coerce').fillna(0))
+    shares = group['polarity'].value_counts(normalize=True)
+    parts = [group[group['polarity'] == polarity].nlargest(max(1, round(share * sample_size)), 'like_count')
+             for polarity, share in shares.items()]
+    return pd.concat(parts).sort_values('like_count', ascending=False).head(sample_size)
+
+# rough token count (~4 characters per token for english text), enough to keep prompts inside the context window
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# remove near-duplicate comments (same words regardless of case, punctuation or spacing) and rank the rest by likes.
+# Comments that stand for several copies (counts, see collapse_duplicates) are prefixed with "(xN)"
+def rank_comments(comments, like_counts=None, counts=None):
+    if like_counts is None:
+        like_counts = [0] * len(comments)
+    if counts is None:
+        counts = [1] * len(comments)
+
+    ranked = pd.DataFrame({'comment': list(comments), 'like_count': list(like_counts), 'count': list(counts)})
+    ranked['like_count'] = pd.to_numeric(ranked['like_count'], errors='coerce').fillna(0)
+    ranked['key'] = ranked['comment'].astype(str).str.lower().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    ranked = ranked[ranked['key'] != '']
+    ranked['count'] = ranked.groupby('key')['count'].transform('sum')
+    ranked = ranked.sort_values('like_count', ascending=False, kind='stable').drop_duplicates('key')
+    return [f"(x{count}) {comment}" if count > 1 else str(comment) for comment, count in zip(ranked['comment'], ranked['count'])]
+
+# pack comments (most liked first) into chunks of at most max_tokens each, up to max_chunks chunks
+def chunk_comments(comments, max_tokens, max_chunks=None):
+    chunks = []
+    current, current_tokens = [], 0
+    for comment in comments:
+        line = f"- {comment}\n"
+        tokens = estimate_tokens(line)
+        if tokens > max_tokens: # a single huge comment is cut to fit
+            line = line[:max_tokens * 4 - 2] + "\n"
+            tokens = estimate_tokens(line)
+
+        if current_tokens + tokens > max_tokens and len(current) != 0:
+            chunks.append(current)
+            if max_chunks is not None and len(chunks) == max_chunks:
+                return chunks
+            current, current_tokens = [], 0
+
+        current.append(line)
+        current_tokens += tokens
+
+    if len(current) != 0:
+        chunks.append(current)
+    return chunks[:max_chunks]
+
+# merge the partial results of each chunk (e.g. "POSITIVE: ...") into a single sentiment and summary.
+# The partial results are packed into prompts that fit the context window (see chunk_comments) and each pack
+# is merged into one result, pass after pass until a single one is left. Every partial result is a completion
+# of at most COMPLETION_TOKENS, so each pack holds several of them and every pass leaves fewer results
+def reduce_analyses(cliente, search_query, video_title, partial_results, cache=None, metrics=None, video_id=None):
+    prompt_sistema = f"""You are a marketing agent specialized in summarizing opinions about "{search_query}". You will receive several 
+    partial analyses of the comments of the same Youtube video, each one made over a different part of the comments, in the format: 
+    one of the four options ["POSITIVE", "NEGATIVE", "NEUTRAL", "NONE"], a colon, and then a summary text. Merge them into a single 
+    analysis: pick the sentiment that best represents all the parts (ignore the "NONE" ones unless all of them are "NONE") and write 
+    a single summary (max. 5 rows) with the most frequent positive and negative aspects. As for the output format to compose your answer, 
+    write spefically in this format, and only this alone: one of the four options ["POSITIVE", "NEGATIVE", "NEUTRAL", "NONE"], a colon, 
+    and then the summary text. Example of answer: "POSITIVE: good pricing and good impressions on...".
+    """
+    header = f"Video Title: {video_title}\n"
+    prompt_tokens = CONTEXT_TOKENS - COMPLETION_TOKENS - estimate_tokens(prompt_sistema) - estimate_tokens(header) - 16
+
+    def reduce_pack(pack):
+        if len(pack) == 1: # nothing to merge it with
+            return pack[0][2:-1]
+        return chat_completion(cliente, prompt_sistema, header + ''.join(pack), max_tokens=COMPLETION_TOKENS, cache=cache,
+                               metrics=metrics, stage='analyze_comments', video_id=video_id)
+
+    while len(partial_results) > 1:
+        partial_results = [reduce_pack(pack) for pack in chunk_comments(partial_results, prompt_tokens)]
+    return partial_results[0]
+
+# function to classify comment sentiments and create a summarization for each video
+# comments are deduplicated, ranked by likes and packed into context-sized chunks which are analyzed
+# concurrently (map), then the partial results are merged into a single answer (reduce)
+def analyze_comments(search_query, video_title, comments, api_key, like_counts=None, max_chunks=MAX_CHUNKS_PER_VIDEO,
+                     max_workers=4, cache=None, counts=None, metrics=None, video_id=None):
+    try:
+        # prompts
+        prompt_sistema = f"""You are a marketing agent specialized in determining whether a video comments' content has a POSITIVE,
+        a NEUTRAL or a NEGATIVE sentiment regarding the subject "{search_query}". Do not consider comments about the video itself (quality, audio or uploaded time/format), only consider those about the subject. After reading all comments, if they did not provide any significant opinion, do not return anything. After reaching an opinion, you must return one
+        of the four options, whichever fits best what you learned from the comments: ["POSITIVE", "NEGATIVE", "NEUTRAL", "NONE"]. The three first are sentiments and the fourth option, "NONE", is for when no significant opinion were provided through the comments. Additionally, summarize (max. 5 rows) the most frequent positive and negative aspects and hightlighted features about the subject if applicable and if there are enough comments to reinforce those opinions (more than 2 comments). As for the output format to compose your answer, write spefically in this format, and only this alone: one of the four options ["POSITIVE", "NEGATIVE", "NEUTRAL", "NONE"], a colon, and then the summary text. Example of answer: "POSITIVE: good pricing and good impressions on...". You must return some text after the sentiment.
+        """
+        
+        # what is left of the context window for the comments
+        prompt_tokens = CONTEXT_TOKENS - COMPLETION_TOKENS - estimate_tokens(prompt_sistema) - estimate_tokens(video_title) - 16
+        ranked = rank_comments(comments, like_counts, counts)
+        header = f"Video Title: {video_title}\n"
+        if any(count > 1 for count in (counts or [])):
+            header += "(comments starting with (xN) were posted N times)\n"
+        chunks = chunk_comments(ranked, prompt_tokens - estimate_tokens(header), max_chunks)
+        if len(chunks) == 0:
+            return "NONE: no comments to analyze."
+
+        # initialize client
+        cliente = load_llm(api_key)
+
+        # build responses
+        def analyze_chunk(chunk):
+            prompt_user = header + ''.join(chunk)
+            return chat_completion(cliente, prompt_sistema, prompt_user, max_tokens=COMPLETION_TOKENS, cache=cache,
+                                   metrics=metrics, stage='analyze_comments', video_id=video_id)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            partial_results = list(executor.map(analyze_chunk, chunks))
+
+        if len(partial_results) == 1:
+            return partial_results[0]
+        result = reduce_analyses(cliente, search_query, video_title, partial_results, cache, metrics, video_id)
+        return result
+    except Exception as err:
+        raise Exception(' analyze_comments:' + str(err))
+
+# split an analysis answer ("POSITIVE: summary...") into sentiment and summary, None when there's no opinion
+def parse_analysis(result):
+    if "NONE" in result or ("POSITIVE:" not in result and "NEGATIVE:" not in result and "NEUTRAL:" not in result):
+        return None
+    return result.split(':', 1)[0].strip(), result.split(':', 1)[1].strip()
+
+# analyze the comments of every video concurrently, up to max_workers videos at a time. The comments are grouped
+# by video in a single pass and on_result(video_id, result, n_done, n_total) is called as each video finishes.
+# With a comment store, videos whose comments didn't change since their last analysis reuse it.
+# When the comments were scored by score_sentiment, content-free ones are dropped and at most
+# sample_size of them per video are sent to the LLM.
+# The video titles come from df_videos, or from a video_title column of df when it isn't given.
+# Returns the answers and the errors, both per video_id.
+def analyze_videos(search_query, df, api_key, max_workers=4, on_result=None, cache=None, store=None,
+                   sample_size=SENTIMENT_SAMPLE_SIZE, metrics=None, df_videos=None):
+    try:
+        videos = [(video_id, group) for video_id, group in df.groupby('video_id', sort=False, observed=True)]
+        if df_videos is not None:
+            titles = df_videos.drop_duplicates('video_id').set_index('video_id')['video_title']
+        else:
+            titles = df.groupby('video_id', sort=False, observed=True)['video_title'].first()
+
+        def analyze_video(video_id, group, fingerprint):
+            if 'polarity' in group.columns:
+                group = sample_comments(group[~group['content_free']], sample_size)
+            counts = group['duplicate_count'].tolist() if 'duplicate_count' in group.columns else None
+            with timed(metrics, 'analyze_comments', video_id):
+                result = analyze_comments(search_query, titles.get(video_id, ''), group['text_display'].tolist(), api_key,
+                                          like_counts=group['like_count'].tolist(), cache=cache, counts=counts,
+                                          metrics=metrics, video_id=video_id)
+            if store is not None:
+                store.set_analysis(video_id, search_query, fingerprint, result)
+            return result
+
+        results, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for video_id, group in videos:
+                fingerprint = None
+                if store is not None:
+                    updated = group['updated'].astype(str)
+                    if 'duplicate_count' in group.columns: # a new copy of a collapsed comment changes its weight
+                        updated = updated + '#' + group['duplicate_count'].astype(str)
+                    fingerprint = comments_fingerprint(group['comment_id'], updated)
+                    result = store.get_analysis(video_id, search_query, fingerprint)
+                    if result is not None:
+                        record(metrics, 'analyze_comments', video_id, reused_analyses=1)
+                        results[video_id] = result
+                        if on_result is not None:
+                            on_result(video_id, result, len(results) + len(errors), len(videos))
+                        continue
+                futures[executor.submit(analyze_video, video_id, group, fingerprint)] = video_id
+
+            for future in as_completed(futures):
+                video_id = futures[future]
+                try:
+                    results[video_id] = future.result()
+                except Exception as err:
+                    errors[video_id] = err
+                    record(metrics, 'analyze_comments', video_id, errors=1)
+                if on_result is not None:
+                    on_result(video_id, results.get(video_id), len(results) + len(errors), len(videos))
+
+        return results, errors
+    except Exception as err:
+        raise Exception(' analyze_videos:' + str(err))
+
+# merge the summaries of several videos into a single one, keeping their positive and negative aspects
+def condense_summaries(cliente, search_query, summaries, cache=None, metrics=None):
+    prompt_sistema = f"""You are a marketing agent specialized in summarizing comments and reviews about "{search_query}". You will 
+    receive several text excerpts, each one summarizing the comments of a different Youtube video. Merge them into a single summary 
+    (max. 10 rows) with the most frequent positive and negative aspects. Write only the summary text.
+    """
+    return chat_completion(cliente, prompt_sistema, ''.join(summaries), max_tokens=COMPLETION_TOKENS, cache=cache,
+                           metrics=metrics, stage='final_summary')
+
+# generate final summary for video list. The sentiment list always goes whole (the overall sentiment is
+# the most frequent one), while the summaries are packed into the rest of the context window: when they
+# don't fit, each pack is merged into a single summary (see condense_summaries) until they do
+def generate_final_summary(search_query, sentiment_list, summary_list, api_key, cache=None, metrics=None):
+    try:
+        prompt_sistema = f"""You are a marketing agent specialized in summarizing comments and reviews about products and topics.
+        You will be given a list of multiple sentiment words (being POSITIVE, NEGATIVE or NEUTRAL), and their respective list of text 
+        excerpts, regarding the topic "{search_query}" from various Youtube videos. Please provide an overall sentiment that can be assigned to the majority of the summaries, 
+        by calculating the most frequent sentiment word, returning only one of the three following sentiments as the most representative: ["POSITIVE", "NEGATIVE", "NEUTRAL"], 
+        and a single summary (max. 10 rows) based on all the provided excerpts. In this summary, write about both the positive aspects as well as the negative ones (no matter which the most predominant sentiment was), including the words "POSITIVE" and "NEGATIVE" as separate topics.
+        As for the output format to compose you answer, write: "OVERALL SENTIMENT: ", followed by the predominant sentiment word, 
+        then break the line and write the summary text separating the positive and negative aspects.
+        """
+        # initialize client
+        cliente = load_llm(api_key)
+
+        sentiments = f"Sentiment list: {sentiment_list}\n"
+        prompt_tokens = CONTEXT_TOKENS - COMPLETION_TOKENS - estimate_tokens(prompt_sistema) - estimate_tokens(sentiments) - 16
+        packs = chunk_comments([str(summary) for summary in summary_list], prompt_tokens)
+        while len(packs) > 1:
+            summary_list = [condense_summaries(cliente, search_query, pack, cache, metrics) for pack in packs]
+            packs = chunk_comments(summary_list, prompt_tokens)
+        prompt_user = sentiments + "Summary list:\n" + ''.join(packs[0] if packs else [])
+
+        # build response
+        result = chat_completion(cliente, prompt_sistema, prompt_user, max_tokens=COMPLETION_TOKENS, cache=cache,
+                                 metrics=metrics, stage='final_summary')
+        return result
+    except Exception as err:
+        raise Exception(' generate_final_summary:' + str(err))
+
+# language filter + pre-processing of the comments frame, serially or over all CPU cores,
+# feeding the word frequencies (when given) along the way
+def preprocess_comments(df_videos_comments, use_all_cores=False, frequencies=None, metrics=None):
+    try:
+        if use_all_cores:
+            with timed(metrics, 'filter_english+preprocessing'):
+                df = parallel_preprocessing(df_videos_comments, frequencies=frequencies)
+        else:
+            with timed(metrics, 'filter_english'):
+                df = filter_english(df_videos_comments)
+            with timed(metrics, 'preprocessing'):
+                df['text_filtered'] = get_preprocessing_engine().transform_batch(df['text_display'])
+                if frequencies is not None:
+                    frequencies.update(df['text_filtered'], df['video_id'])
+        record(metrics, 'filter_english', english_comments=len(df), other_comments=len(df_videos_comments) - len(df))
+        return df
+    except Exception as err:
+        raise Exception(' preprocess_comments:' + str(err))
+
+# the whole analysis, without any UI: search -> relevance -> comments -> pre-processing -> sentiment -> summary.
+# The Youtube client and the response cache are created once and shared by every query the pipeline runs.
+class SentimentPipeline:
+    def __init__(self, api_key, openai_key, youtube=None, cache=None, max_comments=MAX_COMMENTS_PER_VIDEO,
+                 use_all_cores=False, max_workers=4, store=None, sample_size=SENTIMENT_SAMPLE_SIZE, max_replies=0):
+        self.api_key = api_key
+        self.openai_key = openai_key
+        self.youtube = youtube if youtube is not None else load_api(api_key)
+        self.cache = cache
+        self.max_comments = max_comments
+        self.use_all_cores = use_all_cores
+        self.max_workers = max_workers
+        self.store = store # incremental refresh of comments and analyses, when given
+        self.sample_size = sample_size
+        self.max_replies = max_replies # replies harvested per video, none by default
+
+    # run the analysis for a single query; on_progress(message) receives a line of text after each step,
+    # and on_partial(name, value) the partial results as soon as they're known: "videos" (the classified
+    # videos dataframe), "comments" (comments fetched so far) and "sentiments" ({video_id: (sentiment, summary)}
+    # of the videos analyzed so far).
+    # Returns a dict with the videos and comments dataframes, the final summary, the per-video errors
+    # and the metrics (timings, API calls, quota and tokens) of the run
+    def run(self, search_query, max_results, video_urls=(), on_progress=None, metrics=None, on_partial=None):
+        def progress(message):
+            if on_progress is not None:
+                on_progress(message)
+
+        def partial(name, value):
+            if on_partial is not None:
+                on_partial(name, value)
+
+        metrics = metrics if metrics is not None else PipelineMetrics()
+
+        progress("Searching videos...")
+        with timed(metrics, 'search_videos'):
+            df_videos = search_videos(search_query, max_results, self.api_key, cache=self.cache, metrics=metrics, youtube=self.youtube)
+        if len(video_urls) != 0:
+            with timed(metrics, 'add_videos'):
+                df_videos = add_videos(video_urls, df_videos, self.api_key, cache=self.cache, metrics=metrics, youtube=self.youtube)
+
+        # evaluate relevance
+        progress("Determining videos' relevance...")
+        with timed(metrics, 'classify_video'):
+            df_videos = classify_video(search_query, df_videos, self.openai_key, max_workers=self.max_workers, cache=self.cache,
+                                       metrics=metrics)
+        partial('videos', df_videos.copy())
+
+        df, frequencies = self.prepare_comments(df_videos, metrics, progress, partial)
+        df_videos, summary, errors = self.analyze(search_query, df, df_videos, metrics, progress, partial)
+        metrics.add('total', wall_seconds=time.time() - metrics.started)
+
+        return {
+            'search_query': search_query,
+            'videos': df_videos,
+            'comments': df,
+            'word_frequencies': frequencies,
+            'summary': summary,
+            'errors': {video_id: str(err) for video_id, err in errors.items()},
+            'metrics': metrics,
+        }
+
+    # compare several queries (e.g. competing products) on top of shared work: the search results are merged
+    # by video_id, so the comments of a video found by many queries are fetched and pre-processed once,
+    # while relevance, sentiment and the final summary, which depend on the query, are run for each query.
+    # Returns a dict with the merged videos and comments dataframes, the metrics of the whole comparison,
+    # and under "results" the results of each query as returned by run (its comments and word frequencies
+    # being the share of its own videos)
+    def compare(self, search_queries, max_results, on_progress=None, metrics=None, on_partial=None):
+        def progress(message):
+            if on_progress is not None:
+                on_progress(message)
+
+        def partial(name, value):
+            if on_partial is not None:
+                on_partial(name, value)
+
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        search_queries = list(dict.fromkeys(search_queries))
+
+        # search and evaluate relevance for each query
+        query_videos = {}
+        for search_query in search_queries:
+            progress(f"Searching videos for \"{search_query}\"...")
+            with timed(metrics, 'search_videos'):
+                df_videos = search_videos(search_query, max_results, self.api_key, cache=self.cache, metrics=metrics,
+                                          youtube=self.youtube)
+            progress(f"Determining videos' relevance for \"{search_query}\"...")
+            with timed(metrics, 'classify_video'):
+                query_videos[search_query] = classify_video(search_query, df_videos, self.openai_key, max_workers=self.max_workers,
+                                                            cache=self.cache, metrics=metrics)
+
+        # a video is harvested when it's relevant to any of the queries that found it
+        df_all = pd.concat([df_videos.assign(search_query=search_query) for search_query, df_videos in query_videos.items()],
+                           ignore_index=True)
+        relevant = df_all.groupby('video_id', sort=False)['relevance'].agg(lambda labels: (labels != "NOT RELEVANT").any())
+        df_all = df_all.drop_duplicates('video_id').drop(columns=['search_query']).reset_index(drop=True)
+        df_all['relevance'] = np.where(df_all['video_id'].map(relevant), "RELEVANT", "NOT RELEVANT")
+        record(metrics, 'search_videos', videos=sum(len(df_videos) for df_videos in query_videos.values()),
+               unique_videos=len(df_all))
+        partial('videos', df_all.copy())
+
+        df, frequencies = self.prepare_comments(df_all, metrics, progress, partial)
+
+        # the partial sentiments of every query so far, keyed by (search_query, video_id)
+        sentiments = {}
+        def query_partial(search_query):
+            def update(name, value):
+                if name == 'sentiments':
+                    sentiments.update({(search_query, video_id): analysis for video_id, analysis in value.items()})
+                    value = dict(sentiments)
+                partial(name, value)
+            return update
+
+        results = {}
+        for search_query, df_videos in query_videos.items():
+            video_ids = df_videos.loc[df_videos['relevance'] != "NOT RELEVANT", 'video_id']
+            df_query = df[df['video_id'].isin(video_ids)]
+            df_videos, summary, errors = self.analyze(search_query, df_query, df_videos, metrics, progress,
+                                                      query_partial(search_query))
+            results[search_query] = {
+                'search_query': search_query,
+                'videos': df_videos,
+                'comments': df_query,
+                'word_frequencies': frequencies.subset(video_ids),
+                'summary': summary,
+                'errors': {video_id: str(err) for video_id, err in errors.items()},
+                'metrics': None,
+            }
+        metrics.add('total', wall_seconds=time.time() - metrics.started)
+
+        return {
+            'search_queries': search_queries,
+            'videos': df_all,
+            'comments': df,
+            'results': results,
+            'metrics': metrics,
+        }
+
+    # fetch the comments of the relevant videos and pre-process them (language filter, tokens, near-duplicates
+    # and local polarity), returning them along with their word frequencies
+    def prepare_comments(self, df_videos, metrics, progress, partial):
+        progress("Obtaining all videos' comments...")
+        comments_fetched = {'total': 0}
+        def show_comments(video_id, n_comments):
+            comments_fetched['total'] += n_comments
+            progress(f"Obtaining all videos' comments... ({comments_fetched['total']} so far)")
+            partial('comments', comments_fetched['total'])
+        with timed(metrics, 'get_comments'):
+            df_videos_comments = get_video_comments(df_videos, self.youtube, self.max_comments, on_page=show_comments,
+                                                    cache=self.cache, store=self.store, metrics=metrics,
+                                                    max_replies=self.max_replies)
+
+        # applying pre-processing pipeline
+        progress("Pre-processing comments...")
+        frequencies = WordFrequencies()
+        df = preprocess_comments(df_videos_comments, self.use_all_cores, frequencies, metrics)
+        with timed(metrics, 'collapse_duplicates'):
+            df = collapse_duplicates(df)
+        with timed(metrics, 'score_sentiment'):
+            df = score_sentiment(df)
+        return df, frequencies
+
+    # analyze the comments of each video for a query and summarize them, returning the videos with their
+    # sentiment and summary, the final summary and the per-video errors
+    def analyze(self, search_query, df, df_videos, metrics, progress, partial):
+        # apply sentiment analysis and summarize comments
+        progress("Analyzing all comments and preparing summary...")
+        sentiments = {}
+        def show_analysis(video_id, result, n_done, n_total):
+            progress(f"Analyzing all comments and preparing summary... ({n_done}/{n_total} videos)")
+            analysis = None if result is None else parse_analysis(result)
+            if analysis is not None:
+                sentiments[video_id] = analysis
+                partial('sentiments', dict(sentiments))
+        with timed(metrics, 'analyze_videos'):
+            results, errors = analyze_videos(search_query, df, self.openai_key, self.max_workers, on_result=show_analysis,
+                                             cache=self.cache, store=self.store, sample_size=self.sample_size, metrics=metrics,
+                                             df_videos=df_videos)
+
+        df_videos['sentiment'] = None
+        df_videos['summary'] = None
+        for video_id, result in results.items():
+            analysis = parse_analysis(result)
+            if analysis is not None:
+                df_videos.loc[df_videos['video_id'] == video_id, ['sentiment', 'summary']] = analysis
+
+        # final results
+        progress("Generating final results...")
+        with timed(metrics, 'final_summary'):
+            summary = generate_final_summary(search_query, df_videos.sentiment.tolist(), df_videos.summary.tolist(), self.openai_key,
+                                             cache=self.cache, metrics=metrics)
+        return df_videos, summary, errors
+
+# run the analysis for a single query with a pipeline of its own
+def run_analysis(search_query, max_results, api_key, openai_key, cache=None, on_progress=None, **options):
+    pipeline = SentimentPipeline(api_key, openai_key, cache=cache, **options)
+    return pipeline.run(search_query, max_results, on_progress=on_progress)
+
+# base name of the files of a query's results
+def results_name(search_query):
+    return re.sub(r'[^a-z0-9]+', '-', search_query.lower()).strip('-') or 'query'
+
+# base names of the files of several queries saved into the same directory: queries whose names clash
+# (e.g. "iPhone 15" and "iphone-15") get a numbered suffix, so none overwrites the files of another
+def results_names(search_queries):
+    names = {}
+    used = set()
+    for search_query in search_queries:
+        if search_query in names: # the same query twice shares its files
+            continue
+        name = base = results_name(search_query)
+        suffix = 1
+        while name in used:
+            suffix += 1
+            name = f'{base}-{suffix}'
+        used.add(name)
+        names[search_query] = name
+    return names
+
+# save the results of a query into output_dir, as parquet tables (+ a json summary) or a single json file,
+# along with its metrics as json and in the Prometheus text format. The files are named after the query
+# (see results_name) unless a name is given
+def save_results(results, output_dir, output_format='parquet', name=None):
+    os.makedirs(output_dir, exist_ok=True)
+    name = name or results_name(results['search_query'])
+    summary = {key: results[key] for key in ['search_query', 'summary', 'errors']}
+    summary['top_words'] = results['word_frequencies'].top(WORDCLOUD_TOP_WORDS)
+
+    if output_format == 'parquet':
+        results['videos'].to_parquet(os.path.join(output_dir, f'{name}_videos.parquet'), index=False)
+        save_comments(results['comments'], os.path.join(output_dir, f'{name}_comments.parquet'))
+        with open(os.path.join(output_dir, f'{name}_summary.json'), 'w', encoding='utf-8') as file:
+            json.dump(summary, file, ensure_ascii=False, indent=2)
+    else:
+        summary['videos'] = json.loads(results['videos'].to_json(orient='records'))
+        summary['comments'] = json.loads(results['comments'].to_json(orient='records'))
+        with open(os.path.join(output_dir, f'{name}.json'), 'w', encoding='utf-8') as file:
+            json.dump(summary, file, ensure_ascii=False, indent=2)
+
+    if results.get('metrics') is not None:
+        with open(os.path.join(output_dir, f'{name}_metrics.json'), 'w', encoding='utf-8') as file:
+            file.write(results['metrics'].to_json(indent=2))
+        with open(os.path.join(output_dir, f'{name}_metrics.prom'), 'w', encoding='utf-8') as file:
+            file.write(results['metrics'].to_prometheus())
+
+# load the results of a query saved by save_results in the parquet format. The word frequencies only
+# keep the WORDCLOUD_TOP_WORDS words of the summary, which is all the wordcloud draws
+def load_results(output_dir, search_query, name=None):
+    name = name or results_name(search_query)
+    with open(os.path.join(output_dir, f'{name}_summary.json'), encoding='utf-8') as file:
+        summary = json.load(file)
+
+    frequencies = WordFrequencies()
+    frequencies.total.update(summary['top_words'])
+
+    metrics = None
+    metrics_path = os.path.join(output_dir, f'{name}_metrics.json')
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding='utf-8') as file:
+            metrics = PipelineMetrics.from_dict(json.load(file))
+
+    return {
+        'search_query': summary['search_query'],
+        'videos': pd.read_parquet(os.path.join(output_dir, f'{name}_videos.parquet')),
+        'comments': load_comments(os.path.join(output_dir, f'{name}_comments.parquet')),
+        'word_frequencies': frequencies,
+        'summary': summary['summary'],
+        'errors': summary['errors'],
+        'metrics': metrics,
+    }
+
+# save the results of a comparison into output_dir: each query's results as saved by save_results, plus
+# a comparison summary (the queries, the names of their files and their final summaries), the merged videos
+# and the metrics
+def save_comparison(comparison, output_dir, output_format='parquet'):
+    names = results_names(comparison['search_queries'])
+    for search_query, results in comparison['results'].items():
+        save_results(results, output_dir, output_format, names[search_query])
+
+    summary = {
+        'search_queries': comparison['search_queries'],
+        'names': names,
+        'summaries': {search_query: results['summary'] for search_query, results in comparison['results'].items()},
+    }
+    if output_format == 'parquet':
+        comparison['videos'].to_parquet(os.path.join(output_dir, 'comparison_videos.parquet'), index=False)
+    else:
+        summary['videos'] = json.loads(comparison['videos'].to_json(orient='records'))
+    with open(os.path.join(output_dir, 'comparison.json'), 'w', encoding='utf-8') as file:
+        json.dump(summary, file, ensure_ascii=False, indent=2)
+
+    with open(os.path.join(output_dir, 'comparison_metrics.json'), 'w', encoding='utf-8') as file:
+        file.write(comparison['metrics'].to_json(indent=2))
+    with open(os.path.join(output_dir, 'comparison_metrics.prom'), 'w', encoding='utf-8') as file:
+        file.write(comparison['metrics'].to_prometheus())
+
+# load a comparison saved by save_comparison in the parquet format
+def load_comparison(output_dir):
+    with open(os.path.join(output_dir, 'comparison.json'), encoding='utf-8') as file:
+        summary = json.load(file)
+    with open(os.path.join(output_dir, 'comparison_metrics.json'), encoding='utf-8') as file:
+        metrics = PipelineMetrics.from_dict(json.load(file))
+
+    names = summary.get('names', {}) # comparisons saved before the names were kept use results_name
+    results = {search_query: load_results(output_dir, search_query, names.get(search_query))
+               for search_query in summary['search_queries']}
+    comments = pd.concat([query_results['comments'] for query_results in results.values()], ignore_index=True)
+    return {
+        'search_queries': summary['search_queries'],
+        'videos': pd.read_parquet(os.path.join(output_dir, 'comparison_videos.parquet')),
+        'comments': comments.drop_duplicates('comment_id', ignore_index=True),
+        'results': results,
+        'metrics': metrics,
+    }
+
+# command line entry point: runs every query of a file (one per line) with shared clients and cache,
+# or compares them all with --compare.
+# Keys are read from the API_KEY and OPENAI_API_KEY environment variables (or a .env file)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Youtube comments sentiment analysis for a list of search queries.")
+    parser.add_argument('queries_file', help="text file with one search query per line")
+    parser.add_argument('--max-results', type=int, default=10, help="videos searched per query (max. 50)")
+    parser.add_argument('--max-comments', type=int, default=MAX_COMMENTS_PER_VIDEO, help="comments fetched per video")
+    parser.add_argument('--output-dir', default='results')
+    parser.add_argument('--format', choices=['parquet', 'json'], default='parquet')
+    parser.add_argument('--cache', default='.cache/responses.sqlite', help="response cache file")
+    parser.add_argument('--max-replies', type=int, default=0,
+                        help=f"replies fetched per video for the most discussed threads (0 = none, e.g. {MAX_REPLIES_PER_VIDEO})")
+    parser.add_argument('--all-cores', action='store_true', help="pre-process comments using all CPU cores")
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep the comments in a local store and only fetch/analyze what changed since the last run")
+    parser.add_argument('--store', default='.cache/comments.sqlite', help="comment store file used by --incremental")
+    parser.add_argument('--compare', action='store_true',
+                        help="compare the queries with each other, fetching the videos they have in common only once")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.getenv("API_KEY")
+    openai_key = os.getenv("OPENAI_API_KEY")
+    if not api_key or not openai_key:
+        parser.error("API_KEY and OPENAI_API_KEY must be set")
+
+    with open(args.queries_file, encoding='utf-8') as file:
+        queries = [line.strip() for line in file if line.strip()]
+
+    pipeline = SentimentPipeline(api_key, openai_key, cache=load_cache(args.cache), max_comments=args.max_comments,
+                                 use_all_cores=args.all_cores, max_replies=args.max_replies, store=CommentStore(args.store) if args.incremental else None)
+    if args.compare:
+        try:
+            comparison = pipeline.compare(queries, args.max_results,
+                                          on_progress=lambda message: print(f"[compare] {message}", file=sys.stderr))
+            save_comparison(comparison, args.output_dir, args.format)
+        except Exception as err:
+            print(f"[compare] Error: {err}", file=sys.stderr)
+            return 1
+        return 0
+
+    failures = 0
+    names = results_names(queries)
+    for search_query in queries:
+        try:
+            results = pipeline.run(search_query, args.max_results,
+                                   on_progress=lambda message: print(f"[{search_query}] {message}", file=sys.stderr))
+            save_results(results, args.output_dir, args.format, names[search_query])
+        except Exception as err:
+            failures += 1
+            print(f"[{search_query}] Error: {err}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from pipeline_metrics import QUOTA_UNITS, record
+
+# Youtube Data API root, YOUTUBE_API_ROOT can point it to a local stand-in (see benchmarks/)
+YOUTUBE_API_ROOT = os.getenv('YOUTUBE_API_ROOT', 'https://www.googleapis.com/')
+
+RETRY_STATUS = {429, 500, 502, 503, 504} # rate limits and transient server errors
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'} # the only 403s worth retrying
+MAX_IDS_PER_CALL = 50 # ids accepted by a single videos().list call
+
+# error answered by the Youtube Data API, with its HTTP status and reason (e.g. "commentsDisabled", "quotaExceeded")
+class YoutubeApiError(Exception):
+    def __init__(self, status, reason, message):
+        super().__init__(f'{status} {reason}: {message}')
+        self.status = status
+        self.reason = reason
+
+# minimal Youtube Data API client over a single requests session: connections are kept alive and pooled
+# (the session is shared by every thread harvesting comments), parameters are URL-encoded by requests, and
+# rate limits and transient errors are retried with exponential backoff. Every call is recorded in the
+# metrics, when given, with its quota cost.
+class YoutubeClient:
+    def __init__(self, api_key, root=YOUTUBE_API_ROOT, pool_size=16, max_retries=5, base_delay=1.0, timeout=30):
+        self.api_key = api_key
+        self.root = root.rstrip('/') + '/youtube/v3/'
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # GET an endpoint ("search", "videos", "commentThreads"...) and return its JSON answer
+    def get(self, endpoint, params, metrics=None, stage=None, video_id=None):
+        params = dict(params, key=self.api_key)
+        stage = stage or endpoint
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(self.root + endpoint, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                record(metrics, stage, video_id, api_calls=1, quota_units=QUOTA_UNITS.get(endpoint, 1), bytes=len(response.content))
+                if response.ok:
+                    return response.json()
+
+                status, reason, message = response.status_code, '', response.text
+                try:
+                    error = response.json()['error']
+                    message = error.get('message', message)
+                    reason = error.get('errors', [{}])[0].get('reason', '')
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    pass
+
+                # the daily quota or disabled comments won't come back by waiting, so fail right away
+                retryable = status in RETRY_STATUS or (status == 403 and reason in RATE_LIMIT_REASONS)
+                if not retryable or attempt == self.max_retries:
+                    raise YoutubeApiError(status, reason, message)
+
+            record(metrics, stage, video_id, retries=1)
+            time.sleep(self.base_delay * (2 ** attempt) + random.uniform(0, self.base_delay))
+
+    def search(self, query, max_results, metrics=None, stage='search_videos', **params):
+        params = dict({'part': 'snippet', 'q': query, 'maxResults': max_results, 'type': 'video'}, **params)
+        return self.get('search', params, metrics, stage)
+
+    # snippets of any number of videos, MAX_IDS_PER_CALL ids per call
+    def videos(self, video_ids, metrics=None, stage='add_videos', part='snippet'):
+        video_ids = list(dict.fromkeys(video_ids))
+        items = []
+        for i in range(0, len(video_ids), MAX_IDS_PER_CALL):
+            response = self.get('videos', {'part': part, 'id': ','.join(video_ids[i:i + MAX_IDS_PER_CALL])}, metrics, stage)
+            items.extend(response.get('items', []))
+        return items
+
+    def comment_threads(self, params, metrics=None, stage='get_comments', video_id=None):
+        return self.get('commentThreads', params, metrics, stage, video_id)
+
+    # replies of a thread, with params['parentId'] set to its comment id
+    def comments(self, params, metrics=None, stage='get_replies', video_id=None):
+        return self.get('comments', params, metrics, stage, video_id)
+
+    def close(self):
+        self.session.close()